@@ -39,14 +39,20 @@ from mysql.connector.dbapi import (
     STRING, BINARY, NUMBER, DATETIME, ROWID,
     apilevel, threadsafety, paramstyle)
 from mysql.connector.optionfiles import read_option_files
+import asyncio
 
 _CONNECTION_POOLS = {}
 
+# Failover servers which failed recently, mapped to the loop time from
+# which they are tried again
+_FAILOVER_DOWN = {}
+FAILOVER_RETRY_AFTER = 5
+
 
 def _get_pooled_connection(**kwargs):
     """Return a pooled MySQL connection"""
     # If no pool name specified, generate one
-    from .pooling import (MySQLConPooL, generate_pool_name, CONNECTION_POOL_LOCK)
+    from .pooling import (MySQLConPool, generate_pool_name, CONNECTION_POOL_LOCK)
 
     try:
         pool_name = kwargs['pool_name']
@@ -60,8 +66,8 @@ def _get_pooled_connection(**kwargs):
         elif isinstance(_CONNECTION_POOLS[pool_name], MySQLConPool):
             # pool_size must be the same
             check_size = _CONNECTION_POOLS[pool_name].pool_size
-            if ('pool_size' in kwargs
-                    and kwargs['pool_size'] != check_size):
+            new_size = kwargs.get('pool_max_size') or kwargs.get('pool_size')
+            if new_size and new_size != check_size:
                 raise PoolError("Size can not be changed "
                                 "for active pools.")
 
@@ -73,9 +79,47 @@ def _get_pooled_connection(**kwargs):
             "Failed getting connection from pool '{0}'".format(pool_name))
 
 
+def _failover_key(server):
+    """Returns the key of a failover server in the negative cache"""
+    return (server.get('host'), server.get('port'), server.get('unix_socket'))
+
+
+@asyncio.coroutine
+def _connect_server(config):
+    """Open a connection, or get one from a pool, using config
+
+    A connection failing or cancelled while connecting is closed.
+    """
+    cnx = connect(**config)
+    if isinstance(cnx, AioMySQLConnection):
+        try:
+            yield from cnx.connect()
+        except (Exception, asyncio.CancelledError):
+            cnx.disconnect()
+            raise
+        return cnx
+    return (yield from cnx)
+
+
+def _release_connection(cnx):
+    """Close a connection opened by a failover probe which lost"""
+    if isinstance(cnx, AioMySQLConnection):
+        cnx.disconnect()
+    else:
+        cnx.close()
+
+
+@asyncio.coroutine
 def _get_failover_connection(**kwargs):
     """Return a MySQL connection and try to failover if needed
 
+    The servers are probed concurrently and the first connection made is
+    returned; the other probes are cancelled. With failover_stagger set,
+    the next server is only probed when the previous ones failed or did
+    not answer within failover_stagger seconds, in the order given.
+    Servers which failed are skipped for failover_retry_after seconds,
+    unless all servers failed recently.
+
     An InterfaceError is raise when no MySQL is available. ValueError is
     raised when the failover server configuration contains an illegal
     connection argument. Supported arguments are user, password, host, port,
@@ -84,36 +128,68 @@ def _get_failover_connection(**kwargs):
 
     Returns AioSQLConnection instance.
     """
+    from .balancing import check_failover
+
     config = kwargs.copy()
     try:
         failover = config['failover']
     except KeyError:
         raise ValueError('failover argument not provided')
     del config['failover']
-
-    support_cnx_args = set(
-        ['user', 'password', 'host', 'port', 'unix_socket',
-         'database', 'pool_name', 'pool_size'])
+    stagger = config.pop('failover_stagger', None)
+    retry_after = config.pop('failover_retry_after', FAILOVER_RETRY_AFTER)
+    loop = config.get('loop') or asyncio.get_event_loop()
 
     # First check if we can add all use the configuration
-    for server in failover:
-        diff = set(server.keys()) - support_cnx_args
-        if diff:
-            raise ValueError(
-                "Unsupported connection argument {0} in failover: {1}".format(
-                    's' if len(diff) > 1 else '',
-                    ', '.join(diff)))
-
-    for server in failover:
-        new_config = config.copy()
-        new_config.update(server)
-        try:
-            return connect(**new_config)
-        except Error:
-            # If we failed to connect, we try the next server
-            pass
+    check_failover(failover)
 
-    raise InterfaceError("Could not failover: no MySQL server available")
+    now = loop.time()
+    servers = [server for server in failover
+               if _FAILOVER_DOWN.get(_failover_key(server), 0) <= now]
+    servers = servers or list(failover)
+
+    probes = {}
+    pending = set()
+    result = None
+    error = None
+    try:
+        while (servers or pending) and result is None:
+            if servers:
+                server = servers.pop(0)
+                new_config = config.copy()
+                new_config.update(server)
+                probe = loop.create_task(_connect_server(new_config))
+                probes[probe] = server
+                pending.add(probe)
+                if not stagger and servers:
+                    continue
+            (done, pending) = yield from asyncio.wait(
+                pending, timeout=stagger if servers else None,
+                return_when=asyncio.FIRST_COMPLETED, loop=loop)
+            for probe in done:
+                key = _failover_key(probes[probe])
+                err = probe.exception()
+                if err is None:
+                    _FAILOVER_DOWN.pop(key, None)
+                    if result is None:
+                        result = probe.result()
+                    else:
+                        _release_connection(probe.result())
+                elif isinstance(err, Error):
+                    # If we failed to connect, we try the next server
+                    _FAILOVER_DOWN[key] = loop.time() + retry_after
+                    error = err
+                else:
+                    raise err
+    finally:
+        for probe in pending:
+            probe.cancel()
+
+    if result is None:
+        raise InterfaceError(
+            "Could not failover: no MySQL server available ({0})".format(
+                error))
+    return result
 
 
 def connect(*args, **kwargs):
@@ -126,6 +202,13 @@ def connect(*args, **kwargs):
     or pool_size, a pool is created or a previously one is used to return
     a PooledAioSQLConnection.
 
+    When the failover argument is given, a coroutine is returned which
+    probes the servers and returns the first connection made; see
+    _get_failover_connection() for failover_stagger and
+    failover_retry_after. As for pooled connections, the result has to be
+    waited for:
+        cnx = yield from connect(failover=[...], user='...')
+
     Returns AioSQLConnection or PooledAioSQLConnection.
     """
     # Option files
@@ -146,8 +229,8 @@ def connect(*args, **kwargs):
 
     # Pooled connections
     try:
-        from mysql.connector.pooling import CNX_POOL_ARGS
-        if any([key in kwargs for key in CNX_POOL_ARGS]):
+        from .pooling import AIO_CNX_POOL_ARGS
+        if any([key in kwargs for key in AIO_CNX_POOL_ARGS]):
             return _get_pooled_connection(**kwargs)
     except NameError:
         # No pooling
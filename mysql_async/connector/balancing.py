@@ -0,0 +1,262 @@
+# MySQL Connector/Python - MySQL driver written in Python.
+# Copyright (c) 2014, Oracle and/or its affiliates. All rights reserved.
+
+# MySQL Connector/Python is licensed under the terms of the GPLv2
+# <http://www.gnu.org/licenses/old-licenses/gpl-2.0.html>, like most
+# MySQL Connectors. There are special exceptions to the terms and
+# conditions of the GPLv2 as it is applied to this software, see the
+# FOSS License Exception
+# <http://www.mysql.com/about/legal/licensing/foss-exception.html>.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Balancing connections over several MySQL servers
+"""
+
+import random
+
+from mysql.connector import errors
+from .pooling import MySQLConPool
+import asyncio
+
+# Connection arguments which can be given per server in a failover list
+FAILOVER_ARGS = frozenset([
+    'user', 'password', 'host', 'port', 'unix_socket', 'database',
+    'pool_name', 'pool_size'])
+
+STRATEGY_LEAST_OUTSTANDING = 'least_outstanding'
+STRATEGY_POWER_OF_TWO = 'power_of_two'
+
+
+def check_failover(failover):
+    """Check the servers of a failover list
+
+    Raises ValueError when a server uses an unsupported argument.
+    """
+    for server in failover:
+        diff = set(server.keys()) - FAILOVER_ARGS
+        if diff:
+            raise ValueError(
+                "Unsupported connection argument {0} in failover: {1}".format(
+                    's' if len(diff) > 1 else '',
+                    ', '.join(diff)))
+
+
+class _Host(object):
+    """Pool of one server and what is known about its health"""
+
+    def __init__(self, pool, decay):
+        self.pool = pool
+        self.latency = None
+        self.error_rate = 0.0
+        self.lag = None
+        self.ejected_until = 0
+        self._decay = decay
+
+    def observe_latency(self, seconds):
+        """Fold a round trip time into the moving average"""
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency += self._decay * (seconds - self.latency)
+
+    def observe_result(self, failed):
+        """Fold a success or failure into the moving error rate"""
+        self.error_rate += self._decay * ((1.0 if failed else 0.0)
+                                          - self.error_rate)
+
+    @property
+    def outstanding(self):
+        """Number of connections in use or waited for"""
+        gauges = self.pool.metrics.gauges()
+        return gauges['in_use'] + gauges['waiting']
+
+    def score(self):
+        """Lower is better; unmeasured servers are tried first"""
+        outstanding = self.outstanding
+        return ((outstanding + 1) * (self.latency or 0.0), outstanding)
+
+
+class MySQLBalancedPool(object):
+    """Pools for several MySQL servers, balancing connections over them
+
+    failover is the list of servers accepted by connect(); the other
+    keyword arguments are used for every server, including pooling
+    arguments of MySQLConPool.
+
+    get_connection() picks the server using strategy:
+    least_outstanding takes the server with the fewest connections in use
+    or waited for. power_of_two compares two random servers on outstanding
+    connections weighted by their moving average round trip time.
+
+    Round trip times of all commands are measured on the connections.
+    When check_interval is set, every server is pinged in the background
+    every check_interval seconds and, when max_lag is set, its replication
+    lag is read using SHOW SLAVE STATUS. Servers lagging more than max_lag
+    seconds or with a moving error rate above max_error_rate are ejected
+    for eject_time seconds. When all servers are ejected, all are used.
+    """
+
+    def __init__(self, failover, strategy=STRATEGY_POWER_OF_TWO,
+                 check_interval=None, max_lag=None, max_error_rate=None,
+                 eject_time=30, decay=0.2, **kwargs):
+        if not failover:
+            raise ValueError('failover argument not provided')
+        check_failover(failover)
+        if strategy not in (STRATEGY_LEAST_OUTSTANDING,
+                            STRATEGY_POWER_OF_TWO):
+            raise ValueError("Unknown balancing strategy {0}".format(strategy))
+        self._loop = kwargs.pop('loop', None) or asyncio.get_event_loop()
+        self._strategy = strategy
+        self._check_interval = check_interval
+        self._max_lag = max_lag
+        self._max_error_rate = max_error_rate
+        self._eject_time = eject_time
+        self._hosts = []
+        for server in failover:
+            config = kwargs.copy()
+            config.update(server)
+            pool = MySQLConPool(loop=self._loop, **config)
+            self._hosts.append(_Host(pool, decay))
+        self._checker = None
+        if check_interval:
+            self._checker = self._loop.create_task(self._check_hosts())
+
+    @property
+    def pools(self):
+        """List of the pools, one per server"""
+        return [host.pool for host in self._hosts]
+
+    def stats(self):
+        """Returns what is known about each server, by pool name"""
+        now = self._loop.time()
+        return dict((host.pool.pool_name, {
+            'latency': host.latency,
+            'error_rate': host.error_rate,
+            'lag': host.lag,
+            'outstanding': host.outstanding,
+            'ejected': host.ejected_until > now,
+        }) for host in self._hosts)
+
+    def _update_ejection(self, host):
+        """Eject a server when it lags or fails too much"""
+        if (self._max_lag is not None and host.lag is not None
+                and host.lag > self._max_lag) or (
+                    self._max_error_rate is not None
+                    and host.error_rate > self._max_error_rate):
+            host.ejected_until = self._loop.time() + self._eject_time
+
+    def _pick(self, exclude):
+        """Choose the server for the next connection
+
+        Returns a _Host instance.
+        """
+        now = self._loop.time()
+        candidates = [host for host in self._hosts if host not in exclude]
+        healthy = [host for host in candidates if host.ejected_until <= now]
+        candidates = healthy or candidates
+        if self._strategy == STRATEGY_LEAST_OUTSTANDING:
+            return min(candidates,
+                       key=lambda host: (host.outstanding,
+                                         host.latency or 0.0))
+        if len(candidates) > 2:
+            candidates = random.sample(candidates, 2)
+        return min(candidates, key=_Host.score)
+
+    @asyncio.coroutine
+    def get_connection(self, timeout=None, priority=0):
+        """Get a connection from the best server
+
+        When a server can not give a connection, the next best is tried.
+        priority is passed on to MySQLConPool.get_connection().
+
+        Raises InterfaceError when no server is available.
+
+        Returns a PooledMySQLConnection instance.
+        """
+        tried = set()
+        error = None
+        while len(tried) < len(self._hosts):
+            host = self._pick(tried)
+            tried.add(host)
+            try:
+                cnx = yield from host.pool.get_connection(timeout=timeout,
+                                                          priority=priority)
+            except errors.PoolError as err:
+                # Busy, not broken
+                error = err
+                continue
+            except errors.Error as err:
+                host.observe_result(True)
+                self._update_ejection(host)
+                error = err
+                continue
+            host.observe_result(False)
+            cnx.set_round_trip_observer(host.observe_latency)
+            return cnx
+        raise errors.InterfaceError(
+            "No MySQL server available: {0}".format(error))
+
+    @asyncio.coroutine
+    def _check_host(self, host):
+        """Ping a server and read its replication lag"""
+        try:
+            cnx = yield from host.pool.get_connection(
+                timeout=self._check_interval)
+        except errors.PoolError:
+            return
+        except errors.Error:
+            host.observe_result(True)
+            self._update_ejection(host)
+            return
+        try:
+            cnx.set_round_trip_observer(host.observe_latency)
+            yield from cnx.cmd_ping()
+            if self._max_lag is not None:
+                cursor = yield from cnx.cursor(dictionary=True)
+                yield from cursor.execute("SHOW SLAVE STATUS")
+                rows = yield from cursor.fetchall()
+                if not rows:
+                    host.lag = 0
+                else:
+                    lag = rows[0].get('Seconds_Behind_Master')
+                    # NULL when replication is not running
+                    host.lag = float('inf') if lag is None else int(lag)
+            host.observe_result(False)
+        except errors.Error:
+            host.observe_result(True)
+        finally:
+            task = cnx.close()
+            if task is not None:
+                yield from task
+        self._update_ejection(host)
+
+    @asyncio.coroutine
+    def _check_hosts(self):
+        """Check all servers every check_interval seconds, concurrently"""
+        while True:
+            yield from asyncio.sleep(self._check_interval, loop=self._loop)
+            yield from asyncio.wait(
+                [self._loop.create_task(self._check_host(host))
+                 for host in self._hosts], loop=self._loop)
+
+    @asyncio.coroutine
+    def close(self):
+        """Stop checking servers and close all pools"""
+        if self._checker is not None:
+            self._checker.cancel()
+            yield from asyncio.wait([self._checker], loop=self._loop)
+            self._checker = None
+        for host in self._hosts:
+            yield from host.pool.close()
@@ -0,0 +1,204 @@
+# MySQL Connector/Python - MySQL driver written in Python.
+# Copyright (c) 2014, Oracle and/or its affiliates. All rights reserved.
+
+# MySQL Connector/Python is licensed under the terms of the GPLv2
+# <http://www.gnu.org/licenses/old-licenses/gpl-2.0.html>, like most
+# MySQL Connectors. There are special exceptions to the terms and
+# conditions of the GPLv2 as it is applied to this software, see the
+# FOSS License Exception
+# <http://www.mysql.com/about/legal/licensing/foss-exception.html>.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Client-side cache of result sets used by the buffered cursors
+"""
+
+import re
+import time
+from collections import OrderedDict, namedtuple
+
+_TABLE = br'`?(?:\w+`?\.`?)?(\w+)`?'
+RE_SQL_READ_TABLES = re.compile(br'\b(?:FROM|JOIN)\s+' + _TABLE, re.I)
+RE_SQL_WRITE_TABLES = re.compile(
+    br'(?:\bINSERT(?:\s+(?:LOW_PRIORITY|DELAYED|HIGH_PRIORITY|IGNORE))*'
+    br'(?:\s+INTO)?|\bREPLACE(?:\s+(?:LOW_PRIORITY|DELAYED))*(?:\s+INTO)?'
+    br'|\bUPDATE(?:\s+(?:LOW_PRIORITY|IGNORE))*'
+    br'|\bDELETE(?:\s+(?:LOW_PRIORITY|QUICK|IGNORE))*\s+FROM'
+    br'|\bTRUNCATE(?:\s+TABLE)?|\b(?:ALTER|DROP|RENAME)\s+TABLE'
+    br'(?:\s+IF\s+EXISTS)?|\bLOAD\s+DATA\b.*?\bINTO\s+TABLE)\s+' + _TABLE,
+    re.I | re.S)
+# Table references of multi-table UPDATE and DELETE statements
+RE_SQL_UPDATE_REFS = re.compile(br'\bUPDATE\b(.*?)\bSET\b', re.I | re.S)
+RE_SQL_DELETE_REFS = re.compile(
+    br'\bDELETE\b(.*?)(?:\bWHERE\b|\bORDER\s+BY\b|\bLIMIT\b|;|$)',
+    re.I | re.S)
+RE_SQL_TABLE_REFS = re.compile(
+    br'(?:^(?:\s*(?:LOW_PRIORITY|QUICK|IGNORE)\b)*'
+    br'(?!\s*(?:LOW_PRIORITY|QUICK|IGNORE|FROM)\b)'
+    br'|,|\bJOIN\b|\bFROM\b|\bUSING\b)\s*\(?\s*' + _TABLE, re.I)
+# Statements changing tables which can not be told from the statement
+RE_SQL_UNKNOWN_WRITES = re.compile(br'(?:^|;)\s*(?:CALL|EXECUTE)\b', re.I)
+
+# Bytes counted for every row and value besides the data itself
+_ROW_OVERHEAD = 64
+_VALUE_OVERHEAD = 16
+
+CachedResult = namedtuple('CachedResult', ['rows', 'description', 'size',
+                                           'expires', 'tags'])
+
+
+def _table_tags(regex, stmt):
+    """Returns the lower case table names matched in stmt"""
+    if not isinstance(stmt, (bytes, bytearray)):
+        stmt = stmt.encode('utf-8')
+    return set(match.group(1).decode('utf-8', 'replace').lower()
+               for match in regex.finditer(stmt))
+
+
+def tables_read(stmt):
+    """Returns the names of the tables a SELECT reads from"""
+    return _table_tags(RE_SQL_READ_TABLES, stmt)
+
+
+def tables_written(stmt):
+    """Returns the names of the tables a statement changes
+
+    For multi-table UPDATE and DELETE statements, all tables they refer
+    to are returned, including those which are only read.
+
+    Returns a set, or None when the tables can not be told.
+    """
+    if not isinstance(stmt, (bytes, bytearray)):
+        stmt = stmt.encode('utf-8')
+    if RE_SQL_UNKNOWN_WRITES.search(stmt):
+        return None
+    tables = _table_tags(RE_SQL_WRITE_TABLES, stmt)
+    for regex in (RE_SQL_UPDATE_REFS, RE_SQL_DELETE_REFS):
+        for match in regex.finditer(stmt):
+            refs = _table_tags(RE_SQL_TABLE_REFS, match.group(1))
+            if not refs:
+                return None
+            tables.update(refs)
+    return tables
+
+
+class ResultCache(object):
+    """Result sets of statements, kept for a limited time
+
+    Entries are keyed by the statement bytes, prefixed with where and by
+    which user they were executed, and expire after their TTL. When the cached rows take
+    more than max_bytes, the least recently used entries are evicted.
+    Entries are tagged, by default with the tables the statement reads,
+    and invalidate() drops all entries having any of the given tags.
+
+    The same cache can be used by many connections, for example passing
+    it as result_cache argument to a pool.
+    """
+
+    def __init__(self, max_bytes=16 * 1024 * 1024, default_ttl=None,
+                 clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._tags = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _result_size(rows):
+        """Estimate the memory used by raw rows"""
+        size = 0
+        for row in rows:
+            size += _ROW_OVERHEAD
+            for value in row:
+                size += _VALUE_OVERHEAD
+                if value is not None:
+                    try:
+                        size += len(value)
+                    except TypeError:
+                        size += 8
+        return size
+
+    def _remove(self, key):
+        """Remove an entry and its tags"""
+        entry = self._entries.pop(key)
+        self.size -= entry.size
+        for tag in entry.tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def get(self, key):
+        """Returns the cached result of key, or None"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.expires <= self._clock():
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, rows, description, ttl=None, tags=None):
+        """Cache the raw rows of a result set for ttl seconds
+
+        Results larger than max_bytes are not cached.
+        """
+        ttl = self.default_ttl if ttl is None else ttl
+        if not ttl:
+            return
+        rows = tuple(rows)
+        size = self._result_size(rows) + len(key[-1])
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        tags = frozenset(tag.lower() for tag in tags or ())
+        self._entries[key] = CachedResult(rows, description, size,
+                                          self._clock() + ttl, tags)
+        self.size += size
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def invalidate(self, *tags):
+        """Drop all entries having any of tags
+
+        Returns the number of entries dropped.
+        """
+        keys = set()
+        for tag in tags:
+            keys.update(self._tags.get(tag.lower(), ()))
+        for key in keys:
+            self._remove(key)
+        return len(keys)
+
+    def clear(self):
+        """Drop all entries"""
+        self._entries.clear()
+        self._tags.clear()
+        self.size = 0
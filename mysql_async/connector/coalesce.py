@@ -0,0 +1,123 @@
+# MySQL Connector/Python - MySQL driver written in Python.
+# Copyright (c) 2014, Oracle and/or its affiliates. All rights reserved.
+
+# MySQL Connector/Python is licensed under the terms of the GPLv2
+# <http://www.gnu.org/licenses/old-licenses/gpl-2.0.html>, like most
+# MySQL Connectors. There are special exceptions to the terms and
+# conditions of the GPLv2 as it is applied to this software, see the
+# FOSS License Exception
+# <http://www.mysql.com/about/legal/licensing/foss-exception.html>.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Sharing one execution between identical concurrent reads
+"""
+
+import copy
+
+from mysql.connector.conversion import MySQLConverter
+from .cursor import make_statement
+from .routing import is_read_statement
+import asyncio
+
+
+class QueryCoalescer(object):
+    """Single-flight execution of read-only queries
+
+    source is a pool, anything with a get_connection() coroutine, or a
+    connection. Reads whose statements are the same bytes after
+    substituting the parameters, and which are requested while one of
+    them is being executed, share that execution. Every caller gets its
+    own copy of the rows, values included. Other statements are executed
+    as usual.
+
+    When source is a connection, statements are executed one at a time
+    on it.
+    """
+
+    def __init__(self, source, loop=None):
+        self._loop = loop or asyncio.get_event_loop()
+        self._source = source
+        self._pooled = hasattr(source, 'get_connection')
+        self._lock = None if self._pooled else asyncio.Lock(loop=self._loop)
+        self._converter = None
+        self._inflight = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def _statement(self, operation, params):
+        """Returns the statement as bytes, markers substituted"""
+        if self._pooled:
+            if self._converter is None:
+                # pylint: disable=W0212
+                config = self._source._cnx_config
+                self._converter = config.get(
+                    'converter_class', MySQLConverter)(
+                        config.get('charset', 'utf8'),
+                        config.get('use_unicode', True))
+            converter = self._converter
+        else:
+            converter = self._source.converter
+        return make_statement(converter, converter.python_charset,
+                              operation, params)
+
+    @asyncio.coroutine
+    def _execute(self, stmt):
+        """Execute stmt and return its rows and description"""
+        self.executed += 1
+        if self._pooled:
+            cnx = yield from self._source.get_connection()
+            try:
+                cursor = yield from cnx.cursor(buffered=True)
+                yield from cursor.execute(stmt)
+                rows = (yield from cursor.fetchall()) if cursor.with_rows \
+                    else []
+                return (rows, cursor.description)
+            finally:
+                cnx.close()
+        with (yield from self._lock):
+            cursor = yield from self._source.cursor(buffered=True)
+            yield from cursor.execute(stmt)
+            rows = (yield from cursor.fetchall()) if cursor.with_rows else []
+            return (rows, cursor.description)
+
+    @asyncio.coroutine
+    def fetchall(self, operation, params=None, dictionary=False):
+        """Execute a statement and return all its rows
+
+        Rows are tuples, or dictionaries when dictionary is True.
+
+        Returns a list.
+        """
+        stmt = self._statement(operation, params)
+        if not is_read_statement(stmt):
+            (rows, description) = yield from self._execute(stmt)
+        else:
+            future = self._inflight.get(stmt)
+            if future is None:
+                future = self._loop.create_task(self._execute(stmt))
+                self._inflight[stmt] = future
+                future.add_done_callback(
+                    lambda _: self._inflight.pop(stmt, None))
+            else:
+                self.coalesced += 1
+            # Cancelling one caller does not cancel the shared execution
+            (rows, description) = yield from asyncio.shield(
+                future, loop=self._loop)
+            # Values such as sets and bytearrays are mutable
+            rows = copy.deepcopy(rows)
+        if dictionary:
+            names = [column[0] for column in description or ()]
+            return [dict(zip(names, row)) for row in rows]
+        return list(rows)
@@ -24,8 +24,10 @@
 """Implementing communication with MySQL servers.
 """
 
+from concurrent.futures import ProcessPoolExecutor
 from io import IOBase
 import os
+import random
 import re
 import asyncio
 
@@ -33,17 +35,108 @@ from mysql.connector import errors
 from mysql.connector.authentication import get_auth_plugin
 from mysql.connector.catch23 import isstr
 from mysql.connector.constants import (
-    ClientFlag, ServerCmd, ShutdownType, NET_BUFFER_LENGTH)
+    ClientFlag, ServerCmd, ServerFlag, ShutdownType, NET_BUFFER_LENGTH)
 from mysql.connector.cursor import CursorBase
 from .cursor import (
     AioMySQLCursor, AioMySQLCursorRaw,AioMySQLCursorBuffered,
     AioMySQLCursorBufferedRaw, AioMySQLCursorPrepared, AioMySQLCursorDict,
-    AioMySQLCursorBufferedDict, AioMySQLCursorNamedTuple, AioMySQLCursorBufferedNamedTuple)
+    AioMySQLCursorBufferedDict, AioMySQLCursorNamedTuple, AioMySQLCursorBufferedNamedTuple,
+    AioMySQLCursorPrefetch)
+from .cache import tables_written
+from .routing import strip_comments
 from .network import MySQLUnixSocket, MySQLTCPSocket
-from .protocol import AioMySQLProtocol
+from .protocol import (
+    AioMySQLProtocol, CLIENT_SESSION_TRACK, SERVER_SESSION_STATE_CHANGED,
+    SESSION_TRACK_SYSTEM_VARIABLES, SESSION_TRACK_SCHEMA,
+    SESSION_TRACK_TRANSACTION_STATE)
 from mysql.connector.utils import int4store
 from mysql.connector.connection import MySQLConnection
 
+# Connection arguments only known to AioMySQLConnection. They are stored as
+# private attributes (prefixed with an underscore) and removed from the
+# arguments before these are passed on to MySQLConnection.config().
+AIO_DEFAULT_CONFIGURATION = {
+    'convert_executor': None,
+    'convert_threshold': 10000,
+    'ping_interval': 30,
+    'pipeline_warnings': False,
+    'session_track': True,
+    'defer_transactions': False,
+    'result_cache': None,
+    'result_cache_invalidate': True,
+    'query_timeout': None,
+    'drain_on_cancel': True,
+}
+
+# Set after connecting when CLIENT_SESSION_TRACK was negotiated so the
+# server reports changes of the session state cached by the connection.
+SESSION_TRACK_VARIABLES = (
+    "SESSION session_track_system_variables = "
+    "'autocommit,sql_mode,time_zone,character_set_client,"
+    "character_set_results,character_set_connection', "
+    "session_track_schema = ON, session_track_state_change = ON, "
+    "session_track_transaction_info = 'STATE'")
+SESSION_TRACK_QUERY = "SET " + SESSION_TRACK_VARIABLES
+
+# Commands which never change the session state
+_STATELESS_COMMANDS = (ServerCmd.PING, ServerCmd.STATISTICS,
+                       ServerCmd.PROCESS_INFO)
+
+# Session variables which can be read from the session state cache
+_TRACKED_VARIABLES = ('autocommit', 'sql_mode', 'time_zone')
+
+# Statements which could make the server ask for a local file; nothing may
+# be pipelined behind them. Matched after leading comments.
+RE_SQL_LOAD = re.compile(br'^\s*LOAD\s', re.I)
+
+# Statements which could return several results; SHOW WARNINGS is not
+# pipelined behind them. Matched after leading comments.
+RE_SQL_MULTI_RESULTS = re.compile(br'^\s*CALL\s|;\s*\S', re.I)
+
+# Errors of statements stopped by KILL QUERY or max_execution_time
+ER_QUERY_INTERRUPTED = 1317
+ER_QUERY_TIMEOUT = 3024
+
+# Seconds run_with_timeout() waits for a killed statement to end before
+# closing the connection
+KILL_QUERY_WAIT = 5
+
+# Errors after which running the whole transaction again can succeed
+ER_LOCK_WAIT_TIMEOUT = 1205
+ER_LOCK_DEADLOCK = 1213
+RETRY_TRANSACTION_ERRORS = {
+    ER_LOCK_WAIT_TIMEOUT: 'lock_wait_timeouts',
+    ER_LOCK_DEADLOCK: 'deadlocks',
+}
+
+
+def retry_delays(backoff, max_backoff):
+    """Generate delays between attempts using decorrelated jitter
+
+    Each delay is random between backoff and three times the previous
+    delay, capped at max_backoff, so clients which failed together do
+    not retry together.
+    """
+    delay = backoff
+    while True:
+        delay = min(max_backoff, random.uniform(backoff, delay * 3))
+        yield delay
+
+
+def _convert_rows(converter_class, charset, use_unicode, rows, description):
+    """Convert rows to Python types using a new converter
+
+    Used when converting in a process pool: the converter of the connection
+    can not be shared with another process, so an equivalent is created.
+    """
+    converter = converter_class(charset, use_unicode)
+    return [converter.row_to_python(row, description) for row in rows]
+
+
+def _convert_rows_with(converter, rows, description):
+    """Convert rows to Python types using the given converter"""
+    return [converter.row_to_python(row, description) for row in rows]
+
 
 class AioMySQLConnection(MySQLConnection):
     """Connection to a MySQL Server"""
@@ -52,11 +145,47 @@ class AioMySQLConnection(MySQLConnection):
         self._loop = loop
         if loop is None:
             self._loop = asyncio.get_event_loop()
+        for key, value in AIO_DEFAULT_CONFIGURATION.items():
+            setattr(self, '_' + key, value)
+        self._warnings_pending = False
+        self._pipelined_warnings = None
+        self._pending_begin = []
+        self._begin_responses = 0
+        self._session_track_active = False
+        self._session_dirty = False
+        self._session_vars = {}
+        self._session_schema = None
+        self._session_schema_known = False
+        self._transaction_state = None
+        self._connected_at = None
+        self._cmd_sent_at = None
+        self._round_trip_observer = None
+        self._connect_args = {}
+        self._cancelled_io = None
+        self._drain_task = None
+        self._server_status = None
+        self._prepared_statements = {}
+        self.transaction_stats = {'retries': 0, 'deadlocks': 0,
+                                  'lock_wait_timeouts': 0, 'exhausted': 0}
 
         if len(kwargs) > 0:
             #self.connect(**kwargs) #removed, for __init__ can not yield from coroutine
             self.config(**kwargs)
 
+    def config(self, **kwargs):
+        """Configure the MySQL Connection
+
+        Arguments found in AIO_DEFAULT_CONFIGURATION are handled here, all
+        others are passed on to MySQLConnection.config().
+        """
+        config = kwargs.copy()
+        for key in AIO_DEFAULT_CONFIGURATION:
+            if key in config:
+                setattr(self, '_' + key, config.pop(key))
+        super(AioMySQLConnection, self).config(**config)
+        # Used to open side connections, see kill_query()
+        self._connect_args.update(config)
+
     @asyncio.coroutine
     def _do_handshake(self):
         """Get the handshake from the MySQL server"""
@@ -89,6 +218,15 @@ class AioMySQLConnection(MySQLConnection):
         if handshake['capabilities'] & ClientFlag.PLUGIN_AUTH:
             self.set_client_flags([ClientFlag.PLUGIN_AUTH])
 
+        # session_track_transaction_info exists as of MySQL 5.7.8
+        self._session_track_active = bool(
+            self._session_track and version >= (5, 7, 8)
+            and handshake['capabilities'] & CLIENT_SESSION_TRACK)
+        if self._session_track_active:
+            self.set_client_flags([CLIENT_SESSION_TRACK])
+        else:
+            self._client_flags &= ~CLIENT_SESSION_TRACK
+
         self._handshake = handshake
         self._server_version = version
 
@@ -210,10 +348,146 @@ class AioMySQLConnection(MySQLConnection):
             self.config(**kwargs)
 
         self._protocol = AioMySQLProtocol()
+        self._pending_begin = []
+        self._begin_responses = 0
+        self._warnings_pending = False
+        self._cancelled_io = None
 
         self.disconnect()
         yield from self._open_connection()
+        self._connected_at = self._loop.time()
         self._post_connection()
+        yield from self._enable_session_track()
+
+    @property
+    def connection_age(self):
+        """Seconds since the connection was opened
+
+        Returns a float, or None when never connected.
+        """
+        if self._connected_at is None:
+            return None
+        return self._loop.time() - self._connected_at
+
+    def _handle_ok(self, packet):
+        """Handle a MySQL OK packet
+
+        This method handles a MySQL OK packet. When the packet contains
+        session state changes, these are applied to the session state cache.
+        When the packet is an Error packet, an errors.Error-exception will
+        be raised.
+
+        Returns a dict()
+        """
+        if packet[4] == 0:
+            ok_pkt = self._protocol.parse_ok(
+                packet, session_track=self._session_track_active)
+            self._handle_server_status(ok_pkt['status_flag'])
+            self._handle_session_state(ok_pkt.get('session_state'))
+            return ok_pkt
+        elif packet[4] == 255:
+            raise errors.get_exception(packet)
+        raise errors.InterfaceError('Expected OK packet')
+
+    def _handle_session_state(self, changes):
+        """Apply session state changes reported in an OK packet"""
+        if not changes:
+            return
+        for kind, value in changes:
+            if kind == SESSION_TRACK_SYSTEM_VARIABLES:
+                self._session_vars[value[0]] = value[1]
+            elif kind == SESSION_TRACK_SCHEMA:
+                self._session_schema = value or None
+                self._session_schema_known = True
+            elif kind == SESSION_TRACK_TRANSACTION_STATE:
+                self._transaction_state = value
+
+    def _clear_session_state(self, keep_schema=False):
+        """Clear the session state cache
+
+        With session tracking, the schema is known right away: it is the
+        database the client sent when the session was initialized, or the
+        current one when keep_schema is True, since COM_RESET_CONNECTION
+        does not change it. Later changes are reported by the server.
+        """
+        schema = self._session_schema if keep_schema else self._database
+        known = self._session_schema_known or not keep_schema
+        self._prepared_statements = {}
+        self._session_vars = {}
+        self._session_schema = (schema or None) if known else None
+        self._session_schema_known = known and self._session_track_active
+        self._transaction_state = None
+
+    @asyncio.coroutine
+    def _enable_session_track(self, keep_schema=False):
+        """Clear the session state cache and enable session tracking
+
+        Must be called each time the session was (re)initialized, since
+        the server then uses the global session_track_* settings again.
+        """
+        self._clear_session_state(keep_schema)
+        if self._session_track_active:
+            yield from self._execute_query(SESSION_TRACK_QUERY)
+        self._session_dirty = False
+
+    @asyncio.coroutine
+    def _load_session_state(self):
+        """Read the cached session variables and schema from the server
+
+        Done once per session; afterwards the server reports changes in OK
+        packets.
+        """
+        row = yield from self._info_query(
+            "SELECT " + ", ".join(["@@session.{0}".format(name)
+                                   for name in _TRACKED_VARIABLES])
+            + ", DATABASE()")
+        for name, value in zip(_TRACKED_VARIABLES, row):
+            self._session_vars.setdefault(name, value)
+        if not self._session_schema_known:
+            self._session_schema = row[-1]
+            self._session_schema_known = True
+
+    @asyncio.coroutine
+    def _get_session_variable(self, name):
+        """Get a session variable, from the session state cache if possible"""
+        if not self._session_track_active:
+            return (yield from self._info_query(
+                "SELECT @@session.{0}".format(name)))[0]
+        if name not in self._session_vars:
+            yield from self._load_session_state()
+        return self._session_vars[name]
+
+    def _handle_server_status(self, flags):
+        """Handle the server flags found in MySQL packets
+
+        Besides what MySQLConnection does, this keeps the flags and notes
+        when the server reports that the session state changed.
+        """
+        super(AioMySQLConnection, self)._handle_server_status(flags)
+        self._server_status = flags
+        if flags & SERVER_SESSION_STATE_CHANGED:
+            self._session_dirty = True
+
+    @property
+    def session_modified(self):
+        """Whether the session state might have been modified
+
+        With session tracking this relies on the server reporting state
+        changes; without it, any command which could change the session
+        counts as a modification. An active transaction always counts.
+        Cleared by connect() and reset_session().
+        """
+        return self._session_dirty or self.in_transaction
+
+    @property
+    def transaction_state(self):
+        """Transaction state as reported by session tracking
+
+        Returns the 8 character state string sent by the server (for
+        example 'T_______' when an explicit transaction is active), or None
+        when session tracking is not active or nothing was reported yet.
+        """
+        return self._transaction_state
 
     @asyncio.coroutine
     def _send_cmd(self, command, argument=None, packet_number=0, packet=None,
@@ -233,21 +507,228 @@ class AioMySQLConnection(MySQLConnection):
 
         Returns a MySQL packet or None.
         """
+        yield from self._wait_drained()
         if self.unread_result:
             raise errors.InternalError("Unread result found.")
 
+        # Statements of a deferred start_transaction() go in front of the
+        # first command which executes something.
+        begin = []
+        if self._pending_begin and command in (ServerCmd.QUERY,
+                                               ServerCmd.STMT_EXECUTE):
+            (begin, self._pending_begin) = (self._pending_begin, [])
+
+        # Prepared statements are not reported by session tracking
+        if command == ServerCmd.STMT_PREPARE or (
+                not self._session_track_active
+                and command not in _STATELESS_COMMANDS):
+            self._session_dirty = True
+
         try:
             yield from self._socket.drain()
+            for query in begin:
+                self._socket.send(
+                    self._protocol.make_command(ServerCmd.QUERY, query), 0)
             self._socket.send(
                 self._protocol.make_command(command, packet or argument),
                 packet_number)
         except AttributeError:
             raise errors.OperationalError("MySQL Connection not available.")
+        self._begin_responses += len(begin)
+        self._cmd_sent_at = self._loop.time()
 
         if not expect_response:
             return None
 
-        return (yield from self._socket.recv())
+        return (yield from self._recv_response())
+
+    @asyncio.coroutine
+    def _recv_response(self):
+        """Receive the first packet of the response to the last command
+
+        When statements of a deferred start_transaction() were sent in
+        front of the command, their responses are read first. If one of
+        them failed, the response to the command is read and discarded and
+        the error is raised. Note that the server did execute the command.
+
+        Returns a MySQL packet.
+        """
+        error = None
+        try:
+            while self._begin_responses:
+                begin_packet = yield from self._socket.recv()
+                self._begin_responses -= 1
+                try:
+                    self._handle_ok(begin_packet)
+                except errors.Error as err:
+                    error = error or err
+            packet = yield from self._socket.recv()
+        except asyncio.CancelledError:
+            self._io_cancelled('response')
+            raise
+        if self._round_trip_observer is not None \
+                and self._cmd_sent_at is not None:
+            self._round_trip_observer(self._loop.time() - self._cmd_sent_at)
+            self._cmd_sent_at = None
+        if error is not None:
+            try:
+                yield from self._skip_result(packet)
+            except asyncio.CancelledError:
+                self._io_cancelled(None)
+                raise
+            raise error
+        return packet
+
+    def _io_cancelled(self, phase):
+        """Handle a command cancelled while reading its response
+
+        phase tells which part of the result was being read: 'response'
+        for the first packet, 'columns' or 'rows'; None when unknown. The
+        rest of the response is read and discarded in a background task,
+        which the next command waits for. When that is not possible, or
+        drain_on_cancel is False, the connection is closed. Either way,
+        the session is marked as modified.
+        """
+        if self._cancelled_io is not None or self._drain_task is not None:
+            # Already handled where the cancellation happened
+            return
+        self._session_dirty = True
+        if phase is None or not self._drain_on_cancel or not self._socket \
+                or self._socket.desynced:
+            self._begin_responses = 0
+            self._warnings_pending = False
+            self.disconnect()
+            self._unread_result = False
+            return
+        self._cancelled_io = phase
+        self._unread_result = False
+        self._drain_task = self._loop.create_task(self._drain_cancelled())
+
+    @asyncio.coroutine
+    def _drain_cancelled(self):
+        """Discard the rest of the response of a cancelled command"""
+        phase = self._cancelled_io
+        try:
+            if phase == 'response':
+                while self._begin_responses:
+                    yield from self._socket.recv()
+                    self._begin_responses -= 1
+                yield from self._skip_result((yield from self._socket.recv()))
+            else:
+                packet = yield from self._skip_result_sets(
+                    2 if phase == 'columns' else 1)
+                if self._more_results(packet):
+                    yield from self._skip_result(
+                        (yield from self._socket.recv()))
+            self._have_next_result = False
+            if self._warnings_pending:
+                self._warnings_pending = False
+                yield from self._skip_result((yield from self._socket.recv()))
+        except (Exception, asyncio.CancelledError):  # pylint: disable=W0703
+            self.disconnect()
+        finally:
+            self._cancelled_io = None
+            self._drain_task = None
+
+    @asyncio.coroutine
+    def _wait_drained(self):
+        """Wait until the response of a cancelled command was discarded"""
+        task = self._drain_task
+        if task is not None:
+            yield from asyncio.wait([task], loop=self._loop)
+
+    @property
+    def draining(self):
+        """Whether the response of a cancelled command is being discarded"""
+        return self._drain_task is not None
+
+    def set_round_trip_observer(self, observer):
+        """Report the round trip time of commands
+
+        observer is called with the number of seconds between sending a
+        command and receiving the first packet of its response. None stops
+        reporting.
+        """
+        self._round_trip_observer = observer
+
+    def _more_results(self, packet):
+        """Reports whether more results follow an OK or EOF packet"""
+        if packet[4] == 254 and len(packet) >= 9:
+            status = packet[7] | (packet[8] << 8)
+        elif packet[4] == 0:
+            status = self._protocol.parse_ok(packet)['status_flag']
+        else:
+            return False
+        return bool(status & ServerFlag.MORE_RESULTS_EXISTS)
+
+    @asyncio.coroutine
+    def _skip_result_sets(self, phases):
+        """Discard the column definitions and/or rows of a result set
+
+        phases is 2 to start in the column definitions and 1 to start in
+        the rows. Each phase ends with an EOF packet; a row starting with
+        0xfe is always longer than an EOF packet. Packets are skipped by
+        the socket without parsing them.
+
+        Returns the last packet read, an EOF or Error packet.
+        """
+        for _ in range(phases):
+            packet = yield from self._socket.skip_until_eof()
+            if packet[4] == 255:
+                break
+        return packet
+
+    @asyncio.coroutine
+    def discard_result(self):
+        """Discard unread results without parsing their rows
+
+        The rest of the current result set, a pipelined SHOW WARNINGS and
+        the results of further statements sent at once are skipped, reading
+        only packet headers. Errors returned by the MySQL server in these
+        results are ignored.
+        """
+        if self._drain_task is not None:
+            yield from self._wait_drained()
+            return
+        try:
+            if self.unread_result:
+                packet = yield from self._skip_result_sets(1)
+                self.unread_result = False
+                if packet[4] == 254:
+                    self._handle_server_status(
+                        packet[7] | (packet[8] << 8))
+                if self._more_results(packet):
+                    yield from self._skip_result(
+                        (yield from self._socket.recv()))
+                if self._warnings_pending:
+                    self._warnings_pending = False
+                    yield from self._skip_result(
+                        (yield from self._socket.recv()))
+            elif self._have_next_result:
+                yield from self._skip_result((yield from self._socket.recv()))
+        except asyncio.CancelledError:
+            self._io_cancelled(None)
+            raise
+        self._pipelined_warnings = None
+        self._have_next_result = False
+
+    @asyncio.coroutine
+    def _skip_result(self, packet):
+        """Read and discard the rest of the result starting with packet
+
+        Results of further statements, following when several were sent
+        at once, are discarded as well.
+        """
+        while True:
+            if packet[4] == 251:
+                # LOAD DATA LOCAL INFILE request, answer with an empty file
+                self._socket.send(b'')
+                packet = yield from self._socket.recv()
+            elif packet[4] not in (0, 254, 255):
+                packet = yield from self._skip_result_sets(2)
+            if not self._more_results(packet):
+                return
+            packet = yield from self._socket.recv()
 
     @asyncio.coroutine
     def _send_data(self, data_file, send_empty_packet=False):
@@ -336,9 +817,13 @@ class AioMySQLConnection(MySQLConnection):
             raise errors.InterfaceError('Illegal result set.')
 
         columns = [None,] * column_count
-        for i in range(0, column_count):
-            columns[i] = self._protocol.parse_column((yield from self._socket.recv()))
-        eof = self._handle_eof((yield from self._socket.recv()))
+        try:
+            for i in range(0, column_count):
+                columns[i] = self._protocol.parse_column((yield from self._socket.recv()))
+            eof = self._handle_eof((yield from self._socket.recv()))
+        except asyncio.CancelledError:
+            self._io_cancelled('columns')
+            raise
         self.unread_result = True
         return {'columns': columns, 'eof': eof}
 
@@ -355,17 +840,53 @@ class AioMySQLConnection(MySQLConnection):
         if not self.unread_result:
             raise errors.InternalError("No result set available.")
 
-        if binary:
-            rows = yield from self._protocol.read_binary_result(
-                self._socket, columns, count)
-        else:
-            rows = yield from self._protocol.read_text_result(self._socket, count)
+        try:
+            if binary:
+                rows = yield from self._protocol.read_binary_result(
+                    self._socket, columns, count)
+            else:
+                rows = yield from self._protocol.read_text_result(
+                    self._socket, count)
+        except asyncio.CancelledError:
+            self._io_cancelled('rows')
+            raise
+        except errors.Error:
+            # The result ended with an Error packet
+            self.unread_result = False
+            self._have_next_result = False
+            yield from self._read_pipelined_warnings()
+            raise
         if rows[-1] is not None:
             self._handle_server_status(rows[-1]['status_flag'])
             self.unread_result = False
+            yield from self._read_pipelined_warnings()
 
         return rows
 
+    @asyncio.coroutine
+    def convert_rows(self, rows, description):
+        """Convert rows returned by get_rows() to Python types
+
+        Batches of at least convert_threshold rows are converted by the
+        convert_executor, when one was configured, so other coroutines on
+        the event loop are not blocked while a large result is converted.
+        A concurrent.futures.ProcessPoolExecutor receives the raw row values
+        and the column descriptions and returns the converted rows.
+
+        Returns a list.
+        """
+        executor = self._convert_executor
+        if executor is None or len(rows) < self._convert_threshold:
+            row_to_python = self.converter.row_to_python
+            return [row_to_python(row, description) for row in rows]
+
+        if isinstance(executor, ProcessPoolExecutor):
+            return (yield from self._loop.run_in_executor(
+                executor, _convert_rows, self._converter_class,
+                self.charset, self._use_unicode, rows, description))
+        return (yield from self._loop.run_in_executor(
+            executor, _convert_rows_with, self.converter, rows, description))
+
     @asyncio.coroutine
     def get_row(self, binary=False, columns=None):
         """Get the next rows returned by the MySQL server
@@ -395,7 +916,7 @@ class AioMySQLConnection(MySQLConnection):
         return self._handle_ok((yield from self._send_cmd(ServerCmd.INIT_DB, database.encode('utf-8'))))
 
     @asyncio.coroutine
-    def cmd_query(self, query):
+    def cmd_query(self, query, with_warnings=False):
         """Send a query to the MySQL server
 
         This method send the query to the MySQL server and returns the result.
@@ -408,11 +929,42 @@ class AioMySQLConnection(MySQLConnection):
         information as dictionary will be returned. In case the result was
         an error, exception errors.Error will be raised.
 
+        When with_warnings is True and the connection was configured with
+        get_warnings and pipeline_warnings, SHOW WARNINGS is sent right
+        behind the query. Its result is read once the result of the query
+        is complete and is returned by show_warnings().
+
         Returns a tuple()
         """
         if not isinstance(query, bytes):
             query = query.encode('utf-8')
-        result = yield from self._handle_result((yield from self._send_cmd(ServerCmd.QUERY, query)))
+        self._pipelined_warnings = None
+        self._invalidate_cached_results(query)
+
+        pipeline = with_warnings and self.get_warnings \
+            and self._pipeline_warnings
+        if pipeline:
+            stmt = strip_comments(query)
+            pipeline = not (RE_SQL_LOAD.match(stmt)
+                            or RE_SQL_MULTI_RESULTS.search(stmt))
+        if not pipeline:
+            result = yield from self._handle_result(
+                (yield from self._send_cmd(ServerCmd.QUERY, query)))
+        else:
+            yield from self._send_cmd(ServerCmd.QUERY, query,
+                                      expect_response=False)
+            yield from self._send_cmd(ServerCmd.QUERY, b'SHOW WARNINGS',
+                                      expect_response=False)
+            self._warnings_pending = True
+            try:
+                result = yield from self._handle_result(
+                    (yield from self._recv_response()))
+            except errors.Error:
+                self._have_next_result = False
+                yield from self._read_pipelined_warnings()
+                raise
+            if 'columns' not in result:
+                yield from self._read_pipelined_warnings()
 
         if self._have_next_result:
             raise errors.InterfaceError(
@@ -420,13 +972,79 @@ class AioMySQLConnection(MySQLConnection):
 
         return result
 
+    @asyncio.coroutine
+    def _read_pipelined_warnings(self):
+        """Read the result of SHOW WARNINGS sent behind a query
+
+        Nothing is read while results of the query are still to follow.
+        """
+        if not self._warnings_pending or self._have_next_result:
+            return
+        self._warnings_pending = False
+        try:
+            packet = yield from self._socket.recv()
+        except asyncio.CancelledError:
+            self._io_cancelled('response')
+            raise
+        result = yield from self._handle_result(packet)
+        if 'columns' in result:
+            (rows, _) = yield from self.get_rows()
+            self._pipelined_warnings = (result['columns'], rows)
+        else:
+            self._pipelined_warnings = (None, [])
+
+    @asyncio.coroutine
+    def show_warnings(self):
+        """Get the warnings of the last statement
+
+        The result of a SHOW WARNINGS pipelined behind the statement by
+        cmd_query() is used when available. Otherwise SHOW WARNINGS is sent
+        using this connection; no cursor is created.
+
+        Returns a list of tuples (Level, Code, Message).
+        """
+        if self._pipelined_warnings is not None:
+            (columns, rows) = self._pipelined_warnings
+            self._pipelined_warnings = None
+        else:
+            result = yield from self.cmd_query("SHOW WARNINGS")
+            columns = result.get('columns')
+            rows = (yield from self.get_rows())[0] if columns else []
+        row_to_python = self.converter.row_to_python
+        return [row_to_python(row, columns) for row in rows]
+
     @asyncio.coroutine
     def next_result(self):
         if not self._have_next_result:
             return None
         if self.unread_result:
                 raise errors.InternalError("Unread result found.")
-        return (yield from self._handle_result((yield from self._socket.recv())))
+        try:
+            result = yield from self._handle_result(
+                (yield from self._socket.recv()))
+        except errors.Error:
+            # An error ends the results of the statement
+            self._have_next_result = False
+            yield from self._read_pipelined_warnings()
+            raise
+        if 'columns' not in result:
+            yield from self._read_pipelined_warnings()
+        return result
+
+    def _invalidate_cached_results(self, query):
+        """Drop cached results of the tables query changes
+
+        Only done when the connection has a result_cache and
+        result_cache_invalidate is True. When the tables can not be told
+        from query, the whole cache is cleared.
+        """
+        if self._result_cache is None or not self._result_cache_invalidate:
+            return
+        tables = tables_written(query)
+        if tables is None:
+            self._result_cache.clear()
+        elif tables:
+            self._result_cache.invalidate(*tables)
 
     @asyncio.coroutine
     def cmd_query_many(self, statements):
@@ -451,6 +1069,7 @@ class AioMySQLConnection(MySQLConnection):
                 statements = bytearray(statements.encode('utf-8'))
             else:
                 statements = bytearray(statements)
+        self._invalidate_cached_results(statements)
 
         # Handle the first query result
 
@@ -528,17 +1147,100 @@ class AioMySQLConnection(MySQLConnection):
         return self._protocol.parse_statistics((yield from self._socket.recv()))
 
     @asyncio.coroutine
-    def cmd_process_kill(self, mysql_pid):
+    def cmd_process_kill(self, mysql_pid, query_only=False):
         """Kill a MySQL process
 
         This method send the PROCESS_KILL command to the server along with
         the process ID. The result is a dictionary with the OK packet
         information.
 
+        When query_only is True, only the statement the process is
+        executing is stopped using KILL QUERY; the process keeps its
+        connection. PROCESS_KILL can not do this.
+
         Returns a dict()
         """
+        if query_only:
+            return (yield from self.cmd_query(
+                "KILL QUERY {0:d}".format(mysql_pid)))
         return self._handle_ok((yield from self._send_cmd(ServerCmd.PROCESS_KILL, int4store(mysql_pid))))
 
+    @asyncio.coroutine
+    def kill_query(self):
+        """Stop the statement this connection is executing
+
+        A side connection is opened using the same arguments and KILL
+        QUERY is sent over it. The statement fails with error 1317 on this
+        connection, which stays usable.
+        """
+        side = AioMySQLConnection(loop=self._loop, **self._connect_args)
+        try:
+            yield from side.connect()
+            yield from side.cmd_process_kill(self.connection_id,
+                                             query_only=True)
+        finally:
+            side.disconnect()
+
+    @asyncio.coroutine
+    def run_with_timeout(self, coro, timeout):
+        """Run coro, stopping the statement it executes after timeout
+
+        When coro, usually executing a statement, did not finish within
+        timeout seconds, the statement is stopped using kill_query() and
+        its interrupted result is read by coro, leaving the connection in
+        a usable state. When the side connection can not be opened, or
+        the statement did not end within KILL_QUERY_WAIT seconds after
+        being killed, the connection is closed instead.
+
+        Raises OperationalError when the statement was stopped.
+
+        Returns the result of coro.
+        """
+        task = self._loop.create_task(coro)
+        try:
+            (done, _) = yield from asyncio.wait([task], timeout=timeout,
+                                                loop=self._loop)
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        if not done:
+            try:
+                try:
+                    yield from self.kill_query()
+                except errors.Error:
+                    self.disconnect()
+                (done, _) = yield from asyncio.wait(
+                    [task], timeout=KILL_QUERY_WAIT, loop=self._loop)
+                if not done:
+                    # Reading fails once the socket is closed
+                    self.disconnect()
+                    yield from asyncio.wait([task], loop=self._loop)
+            except asyncio.CancelledError:
+                task.cancel()
+                raise
+            try:
+                return task.result()
+            except errors.Error as err:
+                if err.errno in (ER_QUERY_INTERRUPTED, ER_QUERY_TIMEOUT) \
+                        or not self.is_connected_locally():
+                    raise errors.OperationalError(
+                        msg="Statement stopped after the timeout of {0} "
+                            "seconds".format(timeout), errno=err.errno)
+                raise
+            except (EOFError, IOError, AttributeError):
+                # The socket was closed under the statement
+                raise errors.OperationalError(
+                    msg="Statement stopped after the timeout of {0} "
+                        "seconds".format(timeout))
+        return task.result()
+
+    def is_connected_locally(self):
+        """Reports whether the socket is open, without a round trip
+
+        Returns True or False.
+        """
+        return bool(self._socket) and self._socket.is_open()
+
     @asyncio.coroutine
     def cmd_debug(self):
         """Send the DEBUG command
@@ -600,7 +1302,9 @@ class AioMySQLConnection(MySQLConnection):
             raise
 
         self._charset_id = charset
+        self._database = database
         self._post_connection()
+        yield from self._enable_session_track()
 
         return ok_packet
 
@@ -621,7 +1325,42 @@ class AioMySQLConnection(MySQLConnection):
         return True
 
     @asyncio.coroutine
-    def reset_session(self, user_variables=None, session_variables=None):
+    def _check_connection(self):
+        """Reports whether the connection is usable, avoiding a ping
+
+        The state of the transport is checked locally. Only when nothing
+        was received from the MySQL server for more than ping_interval
+        seconds, is_connected() is used to send a PING. Setting
+        ping_interval to 0 or None always sends a PING.
+
+        Returns True or False.
+        """
+        if not self._socket or not self._socket.is_open():
+            return False
+        idle = self._socket.idle_time()
+        if self._ping_interval and idle is not None \
+                and idle < self._ping_interval:
+            return True
+        return (yield from self.is_connected())
+
+    def _make_set_variables(self, user_variables=None, session_variables=None):
+        """Make the assignments of a single SET statement
+
+        Returns a list of bytes.
+        """
+        conv = self.converter
+        assignments = []
+        for fmt, variables in (("@`{0}` = ", user_variables),
+                               ("SESSION `{0}` = ", session_variables)):
+            for key, value in (variables or {}).items():
+                assignments.append(
+                    fmt.format(key).encode('utf-8') +
+                    bytes(conv.quote(conv.escape(conv.to_mysql(value)))))
+        return assignments
+
+    @asyncio.coroutine
+    def reset_session(self, user_variables=None, session_variables=None,
+                      if_modified=False):
         """Clears the current active session
 
         This method resets the session state, if the MySQL server is 5.7.3
@@ -634,31 +1373,54 @@ class AioMySQLConnection(MySQLConnection):
         This method takes two arguments user_variables and session_variables
         which are dictionaries.
 
+        The variables are set using a single SET statement which is sent
+        right behind COM_RESET_CONNECTION, so both are done in one round
+        trip. When if_modified is True, nothing is done when the session
+        was not modified (see session_modified).
+
         Raises OperationalError if not connected, InternalError if there are
         unread results and InterfaceError on errors.
         """
-        cn = yield from self.is_connected()
-        if not cn:
+        self._pending_begin = []
+        yield from self._wait_drained()
+        if if_modified and not self.session_modified:
+            return
+        if not self._socket or not self._socket.is_open():
             raise errors.OperationalError("MySQL Connection not available.")
 
-        try:
-            yield from self.cmd_reset_connection()
-        except errors.NotSupportedError:
+        assignments = self._make_set_variables(user_variables,
+                                               session_variables)
+
+        if self._server_version < (5, 7, 3):
             if self._compress:
                 raise errors.NotSupportedError(
                     "Reset session is not supported with compression for "
                     "MySQL server version 5.7.2 or earlier.")
-            else:
-                yield from self.cmd_change_user(self._user, self._password,
-                                     self._database, self._charset_id)
-
-        cur = yield from self.cursor()
-        if user_variables:
-            for key, value in user_variables.items():
-                yield from cur.execute("SET @`{0}` = %s".format(key), (value,))
-        if session_variables:
-            for key, value in session_variables.items():
-                yield from cur.execute("SET SESSION `{0}` = %s".format(key), (value,))
+            yield from self.cmd_change_user(self._user, self._password,
+                                            self._database, self._charset_id)
+            if assignments:
+                yield from self._execute_query(b"SET " + b", ".join(assignments))
+            self._session_dirty = False
+            return
+
+        if self._session_track_active:
+            assignments.insert(0, SESSION_TRACK_VARIABLES.encode('utf-8'))
+        yield from self._send_cmd(ServerCmd.RESET_CONNECTION,
+                                  expect_response=False)
+        if assignments:
+            yield from self._send_cmd(ServerCmd.QUERY,
+                                      b"SET " + b", ".join(assignments),
+                                      expect_response=False)
+        packets = [(yield from self._socket.recv())]
+        if assignments:
+            packets.append((yield from self._socket.recv()))
+
+        self._handle_ok(packets[0])
+        self._post_connection()
+        self._clear_session_state(keep_schema=True)
+        if assignments:
+            self._handle_ok(packets[1])
+        self._session_dirty = False
 
     @asyncio.coroutine
     def reconnect(self, attempts=1, delay=0):
@@ -722,7 +1484,11 @@ class AioMySQLConnection(MySQLConnection):
     @asyncio.coroutine
     def get_database(self):
         """Get the current database"""
-        return (yield from self._info_query("SELECT DATABASE()"))[0]
+        if not self._session_track_active:
+            return (yield from self._info_query("SELECT DATABASE()"))[0]
+        if not self._session_schema_known:
+            yield from self._load_session_state()
+        return self._session_schema
     database = property(get_database, set_database, doc="Current database")
 
     @asyncio.coroutine
@@ -731,9 +1497,10 @@ class AioMySQLConnection(MySQLConnection):
         yield from self.cmd_query("SET @@session.time_zone = '{0}'".format(value))
         self._time_zone = value
 
+    @asyncio.coroutine
     def get_time_zone(self):
         """Get the current time zone"""
-        return self._info_query("SELECT @@session.time_zone")[0]
+        return (yield from self._get_session_variable('time_zone'))
     time_zone = property(get_time_zone, set_time_zone,
                          doc="time_zone value for current MySQL session")
 
@@ -757,7 +1524,7 @@ class AioMySQLConnection(MySQLConnection):
     @asyncio.coroutine
     def get_sql_mode(self):
         """Get the SQL mode"""
-        return (yield from self._info_query("SELECT @@session.sql_mode"))[0]
+        return (yield from self._get_session_variable('sql_mode'))
     sql_mode = property(get_sql_mode, set_sql_mode,
                         doc="sql_mode value for current MySQL session")
 
@@ -771,14 +1538,15 @@ class AioMySQLConnection(MySQLConnection):
     @asyncio.coroutine
     def get_autocommit(self):
         """Get whether autocommit is on or off"""
-        value = (yield from self._info_query("SELECT @@session.autocommit"))[0]
-        return True if value == 1 else False
+        value = yield from self._get_session_variable('autocommit')
+        # Session tracking reports ON/OFF, SELECT returns 1/0
+        return True if value in (1, '1', 'ON') else False
     autocommit = property(get_autocommit, set_autocommit,
                           doc="autocommit value for current MySQL session")
 
     @asyncio.coroutine
     def cursor(self, buffered=None, raw=None, prepared=None, cursor_class=None,
-               dictionary=None, named_tuple=None):
+               dictionary=None, named_tuple=None, prefetch=None):
         """Instantiates and returns a cursor
 
         By default, MySQLCursor is returned. Depending on the options
@@ -789,6 +1557,9 @@ class AioMySQLConnection(MySQLConnection):
         Dictionary and namedtuple based cursors are available with buffered
         output but not raw.
 
+        When prefetch is True, an unbuffered cursor reading rows ahead in a
+        background task is returned (see AioMySQLCursorPrefetch).
+
         It is possible to also give a custom cursor through the
         cursor_class parameter, but it needs to be a subclass of
         mysql.connector.cursor.CursorBase.
@@ -798,9 +1569,10 @@ class AioMySQLConnection(MySQLConnection):
 
         Returns a cursor-object
         """
+        yield from self._wait_drained()
         if self._unread_result is True:
             raise errors.InternalError("Unread result found.")
-        connected = yield from self.is_connected()
+        connected = yield from self._check_connection()
         if not connected:
             raise errors.OperationalError("MySQL Connection not available.")
         if cursor_class is not None:
@@ -823,6 +1595,8 @@ class AioMySQLConnection(MySQLConnection):
             cursor_type |= 8
         if prepared is True:
             cursor_type |= 16
+        if prefetch is True:
+            cursor_type |= 32
 
         types = {
             0: AioMySQLCursor,  # 0
@@ -833,19 +1607,21 @@ class AioMySQLConnection(MySQLConnection):
             5: AioMySQLCursorBufferedDict,
             8: AioMySQLCursorNamedTuple,
             9: AioMySQLCursorBufferedNamedTuple,
-            16: AioMySQLCursorPrepared
+            16: AioMySQLCursorPrepared,
+            32: AioMySQLCursorPrefetch
         }
         try:
             return (types[cursor_type])(self)
         except KeyError:
-            args = ('buffered', 'raw', 'dictionary', 'named_tuple', 'prepared')
+            args = ('buffered', 'raw', 'dictionary', 'named_tuple', 'prepared',
+                    'prefetch')
             raise ValueError('Cursor not available with given criteria: ' +
-                             ', '.join([args[i] for i in range(5)
+                             ', '.join([args[i] for i in range(6)
                                         if cursor_type & (1 << i) != 0]))
 
     @asyncio.coroutine
     def start_transaction(self, consistent_snapshot=False,
-                          isolation_level=None, readonly=None):
+                          isolation_level=None, readonly=None, deferred=None):
         """Start a transaction
 
         This method explicitly starts a transaction sending the
@@ -859,13 +1635,25 @@ class AioMySQLConnection(MySQLConnection):
             >>> cnx = mysql.connector.connect(..)
             >>> cnx.start_transaction(isolation_level='SERIALIZABLE')
 
+        The access mode is given as characteristic of START TRANSACTION.
+        An isolation level needs a separate SET TRANSACTION statement,
+        which is sent right in front of START TRANSACTION so both take a
+        single round trip.
+
+        When deferred is True, or None and the connection was configured
+        with defer_transactions, nothing is sent yet: the statements go out
+        together with the next query or prepared statement execution.
+        commit() and rollback() of a transaction in which nothing was
+        executed do not contact the server at all.
+
         Raises ProgrammingError when a transaction is already in progress
         and when ValueError when isolation_level specifies an Unknown
         level.
         """
-        if self.in_transaction:
+        if self.in_transaction or self._pending_begin:
             raise errors.ProgrammingError("Transaction already in progress")
 
+        queries = []
         if isolation_level:
             level = isolation_level.strip().replace('-', ' ').upper()
             levels = ['READ UNCOMMITTED', 'READ COMMITTED', 'REPEATABLE READ',
@@ -875,9 +1663,12 @@ class AioMySQLConnection(MySQLConnection):
                 raise ValueError(
                     'Unknown isolation level "{0}"'.format(isolation_level))
 
-            yield from self._execute_query(
+            queries.append(
                 "SET TRANSACTION ISOLATION LEVEL {0}".format(level))
 
+        characteristics = []
+        if consistent_snapshot:
+            characteristics.append("WITH CONSISTENT SNAPSHOT")
         if readonly is not None:
             if self._server_version < (5, 6, 5):
                 raise ValueError(
@@ -885,30 +1676,101 @@ class AioMySQLConnection(MySQLConnection):
                     "this feature".format(self._server_version))
 
             if readonly:
-                access_mode = 'READ ONLY'
+                characteristics.append('READ ONLY')
             else:
-                access_mode = 'READ WRITE'
-            yield from self._execute_query(
-                "SET TRANSACTION {0}".format(access_mode))
+                characteristics.append('READ WRITE')
 
         query = "START TRANSACTION"
-        if consistent_snapshot:
-            query += " WITH CONSISTENT SNAPSHOT"
-        yield from self._execute_query(query)
+        if characteristics:
+            query += " " + ", ".join(characteristics)
+        queries.append(query)
+        queries = [query.encode('utf-8') for query in queries]
+
+        if deferred is None:
+            deferred = self._defer_transactions
+        if deferred:
+            self._pending_begin = queries
+        else:
+            # Pipeline whatever comes before START TRANSACTION
+            self._pending_begin = queries[:-1]
+            yield from self._execute_query(queries[-1])
 
     @asyncio.coroutine
     def commit(self):
         """Commit current transaction"""
+        if self._pending_begin:
+            # Deferred transaction in which nothing was executed
+            self._pending_begin = []
+            return
         yield from self._execute_query("COMMIT")
 
     @asyncio.coroutine
     def rollback(self):
         """Rollback current transaction"""
         if self._unread_result:
-            yield from self.get_rows()
+            yield from self.discard_result()
 
+        if self._pending_begin:
+            self._pending_begin = []
+            return
         yield from self._execute_query("ROLLBACK")
 
+    @asyncio.coroutine
+    def _transaction_attempt(self, func, target, options):
+        """Run func(target) in a transaction and commit it
+
+        The transaction is rolled back when func or the commit fails;
+        errors of the rollback itself are ignored.
+        """
+        yield from self.start_transaction(**options)
+        try:
+            result = func(target)
+            if asyncio.iscoroutine(result):
+                result = yield from result
+            yield from self.commit()
+        except (Exception, asyncio.CancelledError):
+            try:
+                yield from self.rollback()
+            except errors.Error:
+                pass
+            raise
+        return result
+
+    @asyncio.coroutine
+    def run_in_transaction(self, func, retries=3, backoff=0.05,
+                           max_backoff=2.0, **kwargs):
+        """Run func in a transaction, again when it deadlocks
+
+        func is called with this connection as only argument and can be a
+        coroutine function. When it returns, the transaction is committed.
+        When func or the commit fails with a deadlock or lock wait timeout,
+        the transaction is rolled back and run again, at most retries
+        times, after a delay of at least backoff seconds growing randomly
+        up to max_backoff. Other errors are raised after the rollback.
+        kwargs are passed to start_transaction().
+
+        Retries are counted in transaction_stats.
+
+        Returns what func returns.
+        """
+        delays = retry_delays(backoff, max_backoff)
+        attempt = 0
+        while True:
+            try:
+                return (yield from self._transaction_attempt(func, self,
+                                                             kwargs))
+            except errors.Error as err:
+                counter = RETRY_TRANSACTION_ERRORS.get(err.errno)
+                if counter is None:
+                    raise
+                self.transaction_stats[counter] += 1
+                if attempt >= retries:
+                    self.transaction_stats['exhausted'] += 1
+                    raise
+            attempt += 1
+            self.transaction_stats['retries'] += 1
+            yield from asyncio.sleep(next(delays), loop=self._loop)
+
     @asyncio.coroutine
     def _execute_query(self, query):
         """Execute a query
@@ -962,9 +1824,13 @@ class AioMySQLConnection(MySQLConnection):
             raise errors.InterfaceError('Illegal result set.')
 
         columns = [None] * column_count
-        for i in range(0, column_count):
-            columns[i] = self._protocol.parse_column((yield from self._socket.recv()))
-        eof = self._handle_eof((yield from self._socket.recv()))
+        try:
+            for i in range(0, column_count):
+                columns[i] = self._protocol.parse_column((yield from self._socket.recv()))
+            eof = self._handle_eof((yield from self._socket.recv()))
+        except asyncio.CancelledError:
+            self._io_cancelled('columns')
+            raise
         return (column_count, columns, eof)
 
     @asyncio.coroutine
@@ -978,6 +1844,9 @@ class AioMySQLConnection(MySQLConnection):
         """
         packet = yield from self._send_cmd(ServerCmd.STMT_PREPARE, statement)
         result = self._handle_binary_ok(packet)
+        if self._result_cache is not None:
+            # Kept to invalidate cached results when it is executed
+            self._prepared_statements[result['statement_id']] = statement
 
         result['columns'] = []
         result['parameters'] = []
@@ -1004,6 +1873,9 @@ class AioMySQLConnection(MySQLConnection):
         """Execute a prepared MySQL statement"""
         parameters = list(parameters)
         long_data_used = {}
+        statement = self._prepared_statements.get(statement_id)
+        if statement is not None:
+            self._invalidate_cached_results(statement)
 
         if data:
             for param_id, _ in enumerate(parameters):
@@ -1032,6 +1904,7 @@ class AioMySQLConnection(MySQLConnection):
         statement_id. Note that the MySQL server does not return
         anything.
         """
+        self._prepared_statements.pop(statement_id, None)
         rd = yield from self._send_cmd(ServerCmd.STMT_CLOSE, int4store(statement_id),
                                        expect_response=False)
 
@@ -1097,3 +1970,4 @@ class AioMySQLConnection(MySQLConnection):
         rd = yield from self._send_cmd(ServerCmd.RESET_CONNECTION)
         self._handle_ok(rd)
         self._post_connection()
+        yield from self._enable_session_track(keep_schema=True)
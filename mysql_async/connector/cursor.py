@@ -29,12 +29,63 @@ import re
 import asyncio
 
 from mysql.connector import errors
+from .cache import tables_read
+from .routing import is_read_statement
 from mysql.connector.cursor import (
     MySQLCursor, SQL_COMMENT, RE_SQL_COMMENT, RE_SQL_ON_DUPLICATE, RE_SQL_INSERT_STMT,
     RE_SQL_INSERT_VALUES, RE_PY_PARAM, RE_SQL_SPLIT_STMTS, RE_SQL_FIND_PARAM,
     _ERR_NO_RESULT_TO_FETCH, _ParamSubstitutor)
 
 
+def make_statement(converter, charset, operation, params=None):
+    """Encode operation and substitute its markers with params
+
+    Values are converted, escaped and quoted using converter, a
+    MySQLConverter instance. The statement is encoded using the Python
+    charset charset.
+
+    Raises ProgrammingError when params do not match the statement.
+
+    Returns bytes.
+    """
+    try:
+        if not isinstance(operation, (bytes, bytearray)):
+            stmt = operation.encode(charset)
+        else:
+            stmt = operation
+    except (UnicodeDecodeError, UnicodeEncodeError) as err:
+        raise errors.ProgrammingError(str(err))
+
+    if params is None:
+        return stmt
+
+    to_mysql = converter.to_mysql
+    escape = converter.escape
+    quote = converter.quote
+    if isinstance(params, dict):
+        try:
+            values = dict(
+                ("%({0})s".format(key).encode(), quote(escape(to_mysql(value))))
+                for key, value in params.items())
+        except Exception as err:
+            raise errors.ProgrammingError(
+                "Failed processing pyformat-parameters; %s" % err)
+        for key, value in values.items():
+            stmt = stmt.replace(key, value)
+    elif isinstance(params, (list, tuple)):
+        try:
+            values = [quote(escape(to_mysql(value))) for value in params]
+        except Exception as err:
+            raise errors.ProgrammingError(
+                "Failed processing format-parameters; %s" % err)
+        psub = _ParamSubstitutor(values)
+        stmt = RE_PY_PARAM.sub(psub, stmt)
+        if psub.remaining != 0:
+            raise errors.ProgrammingError(
+                "Not all parameters were used in the SQL statement")
+    return stmt
+
+
 class AioMySQLCursor(MySQLCursor):
     """Default cursor for interacting with MySQL
 
@@ -80,12 +131,14 @@ class AioMySQLCursor(MySQLCursor):
     def close(self):
         """Close the cursor
 
+        Rows of the result which were not fetched are discarded.
+
         Returns True when successful, otherwise False.
         """
         if self._connection is None:
             return False
         if self._have_unread_result():
-            raise errors.InternalError("Unread result found.")
+            yield from self._connection.discard_result()
 
         self._reset_result()
         self._executed_list = []
@@ -183,8 +236,14 @@ class AioMySQLCursor(MySQLCursor):
 
         return self
 
+    def _make_statement(self, operation, params=None):
+        """Returns operation as bytes with its markers substituted"""
+        return make_statement(self._connection.converter,
+                              self._connection.python_charset,
+                              operation, params)
+
     @asyncio.coroutine
-    def execute(self, operation, params=None, multi=False):
+    def execute(self, operation, params=None, multi=False, timeout=None):
         """Executes the given operation
 
         Executes the given operation substituting any markers with
@@ -200,8 +259,23 @@ class AioMySQLCursor(MySQLCursor):
         If warnings where generated, and connection.get_warnings is True, then
         self._warnings will be a list containing these warnings.
 
+        When the statement does not finish within timeout seconds, or the
+        query_timeout of the connection when timeout is None, it is
+        stopped on the MySQL server and OperationalError is raised. See
+        AioMySQLConnection.run_with_timeout().
+
         Returns an iterator when multi is True, otherwise None.
         """
+        if self._connection and timeout is None:
+            timeout = self._connection._query_timeout  # pylint: disable=W0212
+        if not timeout:
+            return (yield from self._execute(operation, params, multi))
+        return (yield from self._connection.run_with_timeout(
+            self._execute(operation, params, multi), timeout))
+
+    @asyncio.coroutine
+    def _execute(self, operation, params=None, multi=False):
+        """Executes the given operation, without timeout"""
         if not operation:
             return None
 
@@ -212,26 +286,7 @@ class AioMySQLCursor(MySQLCursor):
 
         self._reset_result()
         self._executed_list = []
-        stmt = ''
-
-        try:
-            if not isinstance(operation, (bytes, bytearray)):
-                stmt = operation.encode(self._connection.python_charset)
-            else:
-                stmt = operation
-        except (UnicodeDecodeError, UnicodeEncodeError) as err:
-            raise errors.ProgrammingError(str(err))
-
-        if params is not None:
-            if isinstance(params, dict):
-                for key, value in self._process_params_dict(params).items():
-                    stmt = stmt.replace(key, value)
-            elif isinstance(params, (list, tuple)):
-                psub = _ParamSubstitutor(self._process_params(params))
-                stmt = RE_PY_PARAM.sub(psub, stmt)
-                if psub.remaining != 0:
-                    raise errors.ProgrammingError(
-                        "Not all parameters were used in the SQL statement")
+        stmt = self._make_statement(operation, params)
 
         if multi:
             self._executed = stmt
@@ -241,7 +296,8 @@ class AioMySQLCursor(MySQLCursor):
         else:
             self._executed = stmt
             try:
-                yield from self._handle_result((yield from self._connection.cmd_query(stmt)))
+                yield from self._handle_result((yield from self._connection.cmd_query(
+                    stmt, with_warnings=True)))
             except errors.InterfaceError:
                 if self._connection._have_next_result:  # pylint: disable=W0212
                     raise errors.InterfaceError(
@@ -459,17 +515,15 @@ class AioMySQLCursor(MySQLCursor):
     @asyncio.coroutine
     def _fetch_warnings(self):
         """
-        Fetch warnings doing a SHOW WARNINGS. Can be called after getting
-        the result.
+        Fetch warnings doing a SHOW WARNINGS on the connection, or using
+        the result pipelined behind the statement. Can be called after
+        getting the result.
 
         Returns a result set or None when there were no warnings.
         """
         res = []
         try:
-            cur = yield from self._connection.cursor()
-            yield from cur.execute("SHOW WARNINGS")
-            res = yield from cur.fetchall()
-            cur.close()
+            res = yield from self._connection.show_warnings()
         except Exception as err:
             raise errors.InterfaceError(
                 "Failed getting warnings; %s" % err)
@@ -552,8 +606,7 @@ class AioMySQLCursor(MySQLCursor):
         (rows, eof) = yield from self._connection.get_rows()
         if self._nextrow[0]:
             rows.insert(0, self._nextrow[0])
-        res = [self._connection.converter.row_to_python(row, self.description)
-               for row in rows]
+        res = yield from self._connection.convert_rows(rows, self.description)
         yield from self._handle_eof(eof)
         rowcount = len(rows)
         if rowcount >= 0 and self._rowcount == -1:
@@ -575,13 +628,84 @@ class AioMySQLCursor(MySQLCursor):
 
 
 class AioMySQLCursorBuffered(AioMySQLCursor):
-    """Cursor which fetches rows within execute()"""
+    """Cursor which fetches rows within execute()
+
+    When the connection has a result_cache, results of reads can be taken
+    from and stored in the cache, see execute().
+    """
 
     def __init__(self, connection=None):
         AioMySQLCursor.__init__(self, connection)
         self._rows = None
         self._next_row = 0
 
+    def _cache_key(self, stmt):
+        """Returns the key of stmt in the result cache
+
+        The key includes the user and the current schema; None is returned
+        when the schema is not known, which is the case without session
+        tracking.
+        """
+        # pylint: disable=W0212
+        cnx = self._connection
+        if not cnx._session_schema_known:
+            return None
+        return (cnx.server_host, cnx.server_port, cnx._user,
+                cnx._session_schema, bytes(stmt))
+
+    @asyncio.coroutine
+    def execute(self, operation, params=None, multi=False, cache_ttl=None,
+                cache_tags=None, timeout=None):
+        """Executes the given operation, using the result cache if any
+
+        When the connection has a result_cache and the current schema is
+        known, a read outside transactions is looked up in the cache using
+        its final statement bytes; cached rows are returned without going
+        to the MySQL server. Otherwise the rows are stored in the cache for
+        cache_ttl seconds, or the default TTL of the cache, tagged with
+        cache_tags or the tables the statement reads.
+
+        See AioMySQLCursor.execute().
+        """
+        cache = self._connection._result_cache if self._connection else None  # pylint: disable=W0212
+        ttl = cache_ttl
+        if cache is not None and ttl is None:
+            ttl = cache.default_ttl
+        if cache is None or multi or not ttl or not operation \
+                or self._connection.in_transaction \
+                or self._connection._pending_begin:  # pylint: disable=W0212
+            return (yield from super(AioMySQLCursorBuffered, self).execute(
+                operation, params, multi, timeout))
+
+        stmt = self._make_statement(operation, params)
+        if not is_read_statement(stmt):
+            return (yield from super(AioMySQLCursorBuffered, self).execute(
+                stmt, None, multi, timeout))
+        if self._connection.unread_result is True:
+            raise errors.InternalError("Unread result found.")
+
+        key = self._cache_key(stmt)
+        if key is None:
+            return (yield from super(AioMySQLCursorBuffered, self).execute(
+                stmt, None, multi, timeout))
+        entry = cache.get(key)
+        if entry is not None:
+            self._reset_result()
+            self._executed = stmt
+            self._description = entry.description
+            self._rows = entry.rows
+            self._rowcount = len(entry.rows)
+            self._next_row = 0
+            return None
+
+        yield from super(AioMySQLCursorBuffered, self).execute(
+            stmt, timeout=timeout)
+        if self._rows is not None:
+            cache.put(key, self._rows, self._description, ttl,
+                      cache_tags if cache_tags is not None
+                      else tables_read(stmt))
+        return None
+
     @asyncio.coroutine
     def _handle_resultset(self):
         (self._rows, eof) = yield from self._connection.get_rows()
@@ -612,10 +736,8 @@ class AioMySQLCursorBuffered(AioMySQLCursor):
     def fetchall(self):
         if self._rows is None:
             raise errors.InterfaceError("No result set to fetch from.")
-        res = []
-        for row in self._rows[self._next_row:]:
-            res.append(self._connection.converter.row_to_python(
-                row, self.description))
+        res = yield from self._connection.convert_rows(
+            self._rows[self._next_row:], self.description)
         self._next_row = len(self._rows)
         return res
 
@@ -866,6 +988,11 @@ class AioMySQLCursorDict(AioMySQLCursor):
             return dict(zip(self.column_names, row))
         return None
 
+    def _rows_from_python(self, rows):
+        """Turn rows already converted to Python types into dictionaries"""
+        names = self.column_names
+        return [dict(zip(names, row)) for row in rows]
+
     @asyncio.coroutine
     def fetchone(self):
         """Returns next row of a query result set
@@ -884,8 +1011,8 @@ class AioMySQLCursorDict(AioMySQLCursor):
         (rows, eof) = yield from self._connection.get_rows()
         if self._nextrow[0]:
             rows.insert(0, self._nextrow[0])
-        res = [self._row_to_python(row, self.description)
-               for row in rows]
+        res = self._rows_from_python((yield from self._connection.convert_rows(
+            rows, self.description)))
         yield from self._handle_eof(eof)
         rowcount = len(rows)
         if rowcount >= 0 and self._rowcount == -1:
@@ -914,6 +1041,13 @@ class AioMySQLCursorNamedTuple(AioMySQLCursor):
             # pylint: enable=W0201
             return self.named_tuple(*row)
 
+    def _rows_from_python(self, rows):
+        """Turn rows already converted to Python types into named tuples"""
+        # pylint: disable=W0201
+        self.named_tuple = namedtuple('Row', self.column_names)
+        # pylint: enable=W0201
+        return [self.named_tuple(*row) for row in rows]
+
     @asyncio.coroutine
     def fetchone(self):
         """Returns next row of a query result set
@@ -932,8 +1066,8 @@ class AioMySQLCursorNamedTuple(AioMySQLCursor):
         (rows, eof) = yield from self._connection.get_rows()
         if self._nextrow[0]:
             rows.insert(0, self._nextrow[0])
-        res = [self._row_to_python(row, self.description)
-               for row in rows]
+        res = self._rows_from_python((yield from self._connection.convert_rows(
+            rows, self.description)))
         yield from self._handle_eof(eof)
         rowcount = len(rows)
         if rowcount >= 0 and self._rowcount == -1:
@@ -961,10 +1095,8 @@ class AioMySQLCursorBufferedDict(AioMySQLCursorDict, AioMySQLCursorBuffered):
         """
         if self._rows is None:
             raise errors.InterfaceError(_ERR_NO_RESULT_TO_FETCH)
-        res = []
-        for row in self._rows[self._next_row:]:
-            res.append(self._row_to_python(
-                row, self.description))
+        res = self._rows_from_python((yield from self._connection.convert_rows(
+            self._rows[self._next_row:], self.description)))
         self._next_row = len(self._rows)
         return res
 
@@ -988,9 +1120,154 @@ class AioMySQLCursorBufferedNamedTuple(AioMySQLCursorNamedTuple, AioMySQLCursorB
         """
         if self._rows is None:
             raise errors.InterfaceError(_ERR_NO_RESULT_TO_FETCH)
-        res = []
-        for row in self._rows[self._next_row:]:
-            res.append(self._row_to_python(
-                row, self.description))
+        res = self._rows_from_python((yield from self._connection.convert_rows(
+            self._rows[self._next_row:], self.description)))
         self._next_row = len(self._rows)
         return res
+
+
+class AioMySQLCursorPrefetch(AioMySQLCursor):
+    """
+    Cursor reading rows ahead in a background task.
+
+    After execute(), a reader task keeps fetching batches of raw rows from
+    the server into a bounded queue while the fetch methods convert and
+    return earlier batches. When the queue holds prefetch_depth batches the
+    reader waits for the consumer, so at most
+    prefetch_size * prefetch_depth raw rows are kept in memory.
+
+    Rows fetched using fetchone() and fetchmany() are converted one batch
+    at a time, and batches below the convert_threshold of the connection
+    are converted on the event loop. fetchall() converts consecutive
+    batches together, so large results still use the convert_executor.
+    """
+    prefetch_size = 1000
+    prefetch_depth = 4
+
+    def __init__(self, connection=None):
+        super(AioMySQLCursorPrefetch, self).__init__(connection)
+        self._prefetch_task = None
+        self._prefetch_queue = None
+        self._prefetch_stop = False
+        self._batch = []
+        self._batch_pos = 0
+        self._batch_eof = None
+
+    def reset(self):
+        self._prefetch_task = None
+        self._prefetch_queue = None
+        self._prefetch_stop = False
+        self._batch = []
+        self._batch_pos = 0
+        self._batch_eof = None
+
+    def _have_unread_result(self):
+        if self._batch_pos < len(self._batch):
+            return True
+        return (self._prefetch_queue is not None
+                and self._batch_eof is None)
+
+    @asyncio.coroutine
+    def _prefetch(self):
+        """Read batches of rows until EOF or until the cursor is closed"""
+        queue = self._prefetch_queue
+        try:
+            while not self._prefetch_stop:
+                (rows, eof) = yield from self._connection.get_rows(
+                    count=self.prefetch_size, binary=self._binary,
+                    columns=self.description)
+                yield from queue.put((rows, eof, None))
+                if eof is not None:
+                    return
+            # Closed before the end of the result; skip what is left so
+            # the connection can be used again.
+            if self._connection.unread_result:
+                yield from self._connection.discard_result()
+        except Exception as err:  # pylint: disable=W0703
+            yield from queue.put(([], None, err))
+
+    @asyncio.coroutine
+    def _handle_resultset(self):
+        loop = self._connection._loop  # pylint: disable=W0212
+        self._prefetch_queue = asyncio.Queue(maxsize=self.prefetch_depth,
+                                             loop=loop)
+        self._prefetch_task = loop.create_task(self._prefetch())
+
+    @asyncio.coroutine
+    def _next_batch(self):
+        """Wait for the next batch read by the prefetch task
+
+        Returns False when there are no more rows.
+        """
+        if self._batch_eof is not None or self._prefetch_queue is None:
+            return False
+        (rows, eof, err) = yield from self._prefetch_queue.get()
+        if err is not None:
+            self._batch_eof = {}
+            raise err
+        self._batch = rows
+        self._batch_pos = 0
+        if eof is not None:
+            self._batch_eof = eof
+            yield from self._handle_eof(eof)
+        return True
+
+    @asyncio.coroutine
+    def _fetch_row(self):
+        while self._batch_pos >= len(self._batch):
+            if not (yield from self._next_batch()):
+                return None
+        row = self._batch[self._batch_pos]
+        self._batch_pos += 1
+        if self._rowcount == -1:
+            self._rowcount = 1
+        else:
+            self._rowcount += 1
+        return row
+
+    @asyncio.coroutine
+    def fetchall(self):
+        if self._prefetch_queue is None:
+            raise errors.InterfaceError(_ERR_NO_RESULT_TO_FETCH)
+        # pylint: disable=W0212
+        threshold = self._connection._convert_threshold
+        # pylint: enable=W0212
+        res = []
+        pending = []
+        while True:
+            rows = self._batch[self._batch_pos:]
+            self._batch_pos = len(self._batch)
+            pending.extend(rows)
+            if self._rowcount == -1:
+                self._rowcount = 0
+            self._rowcount += len(rows)
+            more = yield from self._next_batch()
+            # Convert at least convert_threshold rows at once when possible
+            if pending and (len(pending) >= threshold or not more):
+                res.extend((yield from self._connection.convert_rows(
+                    pending, self.description)))
+                pending = []
+            if not more:
+                break
+        return res
+
+    @asyncio.coroutine
+    def close(self):
+        """Close the cursor
+
+        A running prefetch task is stopped after its current batch; the
+        rest of the result set is read and discarded so the connection
+        stays usable.
+        """
+        task = self._prefetch_task
+        if task is not None and not task.done():
+            self._prefetch_stop = True
+            # Make room so a reader blocked on a full queue can finish its
+            # current batch and notice it has to stop.
+            while not self._prefetch_queue.empty():
+                self._prefetch_queue.get_nowait()
+            yield from asyncio.wait([task], loop=self._connection._loop)  # pylint: disable=W0212
+        self._batch = []
+        self._batch_pos = 0
+        self._batch_eof = {}
+        return (yield from super(AioMySQLCursorPrefetch, self).close())
@@ -0,0 +1,160 @@
+# MySQL Connector/Python - MySQL driver written in Python.
+# Copyright (c) 2014, Oracle and/or its affiliates. All rights reserved.
+
+# MySQL Connector/Python is licensed under the terms of the GPLv2
+# <http://www.gnu.org/licenses/old-licenses/gpl-2.0.html>, like most
+# MySQL Connectors. There are special exceptions to the terms and
+# conditions of the GPLv2 as it is applied to this software, see the
+# FOSS License Exception
+# <http://www.mysql.com/about/legal/licensing/foss-exception.html>.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Counters and histograms reporting what pools are doing"""
+
+from bisect import bisect_left
+
+# Upper bounds, in seconds, of the buckets of latency histograms
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+
+class Histogram(object):
+    """Distribution of observed values over fixed buckets"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        """Add a value to the histogram"""
+        self.counts[min(bisect_left(self.buckets, value),
+                        len(self.buckets) - 1)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def quantile(self, fraction):
+        """Estimate a quantile, for example 0.99
+
+        The upper bound of the bucket holding the quantile is returned,
+        capped at the largest value observed.
+
+        Returns a float, or None when nothing was observed.
+        """
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        """Returns the state of the histogram as a dict"""
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+            'buckets': dict(zip(self.buckets, self.counts)),
+        }
+
+
+class PoolMetrics(object):
+    """Metrics of a connection pool
+
+    Counters only go up. Histograms hold the checkout wait and hold
+    durations in seconds. Gauges are read from the pool when taking a
+    snapshot.
+
+    Listeners are called as listener(pool_name, name, value) for every
+    counter increment and every observed value. They are called on the
+    event loop, in the middle of pool operations, so they should be quick
+    and must not raise.
+    """
+
+    COUNTERS = ('checkouts', 'checkins', 'timeouts', 'connections_created',
+                'connections_closed', 'connect_failures', 'shed',
+                'transaction_retries', 'transaction_retries_exhausted',
+                'deadlocks', 'lock_wait_timeouts')
+    HISTOGRAMS = ('checkout_wait', 'hold_time')
+
+    def __init__(self, pool, buckets=DEFAULT_BUCKETS):
+        self._pool = pool
+        self._listeners = []
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.histograms = dict(
+            (name, Histogram(buckets)) for name in self.HISTOGRAMS)
+
+    def add_listener(self, listener):
+        """Call listener for every metric update"""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        """Stop calling listener"""
+        self._listeners.remove(listener)
+
+    def _notify(self, name, value):
+        """Pass a metric update on to the listeners"""
+        for listener in self._listeners:
+            listener(self._pool.pool_name, name, value)
+
+    def incr(self, name, value=1):
+        """Increment a counter"""
+        self.counters[name] = self.counters.get(name, 0) + value
+        if self._listeners:
+            self._notify(name, value)
+
+    def observe(self, name, value):
+        """Add a value to a histogram"""
+        self.histograms[name].observe(value)
+        if self._listeners:
+            self._notify(name, value)
+
+    def gauges(self):
+        """Returns the current number of connections per state"""
+        # pylint: disable=W0212
+        pool = self._pool
+        idle = len(pool._idle)
+        return {
+            'total': pool._size,
+            'idle': idle,
+            'opening': pool._opening,
+            'in_use': pool._size - pool._opening - idle,
+            'waiting': len(pool._waiters),
+            'max_size': pool.pool_size,
+            'min_size': pool._min_size,
+        }
+
+    def snapshot(self):
+        """Returns all metrics as a dict"""
+        gauges = self.gauges()
+        result = dict(self.counters)
+        result.update(gauges)
+        result['utilization'] = float(gauges['in_use']) / gauges['max_size']
+        for name, histogram in self.histograms.items():
+            result[name] = histogram.snapshot()
+        return result
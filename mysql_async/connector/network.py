@@ -88,6 +88,9 @@ class BaseMySQLSocket(object):
         self._packet_queue = deque()
         self.recvsize = 8192
         self._default_buffer_limit = 2**16
+        self.last_activity = None
+        # Set when reading was cancelled in the middle of a packet
+        self.desynced = False
 
     def set_buffer_limit(self, limit=None):
         if limit is None:
@@ -114,13 +117,37 @@ class BaseMySQLSocket(object):
         """Get the location of the socket"""
         raise NotImplementedError
 
+    def is_open(self):
+        """Reports whether the socket can still be used
+
+        Only the local state of the transport is checked; nothing is sent
+        to the MySQL server.
+
+        Returns True or False.
+        """
+        if self._reader is None or self._writer is None:
+            return False
+        if self._reader.at_eof() or self._reader.exception() is not None:
+            return False
+        return not self._writer.transport.is_closing()
+
+    def idle_time(self):
+        """Seconds since the last packet was received
+
+        Returns a float, or None when nothing was received yet.
+        """
+        if self.last_activity is None:
+            return None
+        return self._loop.time() - self.last_activity
+
     def shutdown(self):
         """Shut down the socket before closing it"""
         try:
             #self.sock.shutdown(socket.SHUT_RDWR)
             #self.sock.close()
-            if not self._writer:
+            if self._writer:
                 self._writer.close()
+            self._reader = self._writer = None
             del self._packet_queue
         except (socket.error, AttributeError):
             pass
@@ -129,8 +156,9 @@ class BaseMySQLSocket(object):
         """Close the socket"""
         try:
             #self.sock.close()
-            if not self._writer:
+            if self._writer:
                 self._writer.close()
+            self._reader = self._writer = None
             del self._packet_queue
         except (socket.error, AttributeError):
             pass
@@ -220,7 +248,12 @@ class BaseMySQLSocket(object):
 
     @asyncio.coroutine
     def recv_plain(self):
-        """Receive packets from the MySQL server"""
+        """Receive packets from the MySQL server
+
+        When cancelled after the header was read, the socket is marked
+        desynced since the rest of the packet is lost.
+        """
+        packet = None
         try:
             # Read the header of the MySQL packet, 4 bytes
             packet = yield from self._reader.readexactly(4)
@@ -244,13 +277,70 @@ class BaseMySQLSocket(object):
                 packet_view[:lrd] = read
                 packet_view = packet_view[lrd:]
                 rest -= lrd
+            self.last_activity = self._loop.time()
             return packet
+        except asyncio.CancelledError:
+            if packet is not None:
+                self.desynced = True
+            raise
         except IOError as err:
             raise errors.OperationalError(
                 errno=2055, values=(self.get_address(), _strioerror(err)))
 
     recv = recv_plain
 
+    @asyncio.coroutine
+    def skip_until_eof(self):
+        """Discard packets up to an EOF or Error packet
+
+        Only packet headers and the first byte of payloads are looked at;
+        the payloads of other packets are dropped without being copied
+        into packets. A packet following one with the maximum payload
+        length continues it and is skipped as a whole.
+
+        Returns the EOF or Error packet.
+        """
+        if self.recv != self.recv_plain:
+            # Compressed packets have to be decompressed anyway
+            packet = yield from self.recv()
+            while not (packet[4] == 254 and len(packet) < 13
+                       or packet[4] == 255):
+                packet = yield from self.recv()
+            return packet
+
+        header = None
+        continued = False
+        try:
+            while True:
+                header = yield from self._reader.readexactly(4)
+                self._packet_number = header[3]
+                payload_len = struct.unpack("<I", header[0:3] + b'\x00')[0]
+                rest = payload_len
+                if not continued and payload_len:
+                    first = yield from self._reader.readexactly(1)
+                    rest -= 1
+                    if (first[0] == 254 and payload_len < 9) \
+                            or first[0] == 255:
+                        payload = yield from self._reader.readexactly(rest)
+                        self.last_activity = self._loop.time()
+                        return bytearray(header + first + payload)
+                while rest:
+                    read = yield from self._reader.read(min(rest, 65536))
+                    if not read:
+                        raise errors.InterfaceError(errno=2013)
+                    rest -= len(read)
+                continued = payload_len == 0xffffff
+                header = None
+        except asyncio.CancelledError:
+            if header is not None:
+                self.desynced = True
+            raise
+        except asyncio.IncompleteReadError:
+            raise errors.InterfaceError(errno=2013)
+        except IOError as err:
+            raise errors.OperationalError(
+                errno=2055, values=(self.get_address(), _strioerror(err)))
+
     def _split_zipped_payload(self, packet_bunch):
         """Split compressed payload"""
         while packet_bunch:
@@ -289,6 +379,7 @@ class BaseMySQLSocket(object):
                     zip_payload = zip_payload + chunk
                 if payload_length == 0:
                     self._split_zipped_payload(zip_payload)
+                    self.last_activity = self._loop.time()
                     return self._packet_queue.popleft()
                 packets.append(header + zip_payload)
                 if payload_length != 16384:
@@ -301,6 +392,7 @@ class BaseMySQLSocket(object):
         except IOError as err:
             raise errors.OperationalError(
                 errno=2055, values=(self.get_address(), _strioerror(err)))
+        self.last_activity = self._loop.time()
 
         tmp = init_bytearray(b'')
         for packet in packets:
@@ -25,51 +25,587 @@
 """
 
 import re
+import math
+import random
+from collections import deque
 from uuid import uuid4
-# pylint: disable=F0401
-try:
-    import queue
-except ImportError:
-    # Python v2
-    import Queue as queue
-# pylint: enable=F0401
 import threading
 
 from mysql.connector import errors
 from mysql.connector.pooling import generate_pool_name, PooledMySQLConnection, MySQLConnectionPool, CNX_POOL_ARGS, CNX_POOL_MAXSIZE, CNX_POOL_MAXNAMESIZE, CNX_POOL_NAMEREGEX
-from .connection import AioMySQLConnection
+from .connection import (
+    AioMySQLConnection, RETRY_TRANSACTION_ERRORS, retry_delays)
+from .metrics import PoolMetrics
 import asyncio
 
+# Only used to guard the registry of pools in mysql_async.connector; the
+# pools themselves are not thread-safe and belong to a single event loop.
 CONNECTION_POOL_LOCK = threading.RLock()
 
+# Arguments of connect() which make it return a pooled connection
+AIO_CNX_POOL_ARGS = CNX_POOL_ARGS + ('pool_timeout', 'pool_min_size',
+                                     'pool_max_size', 'pool_idle_timeout',
+                                     'pool_connect_concurrency',
+                                     'pool_check_interval',
+                                     'pool_stale_timeout',
+                                     'pool_max_lifetime', 'pool_max_uses',
+                                     'pool_lifetime_jitter',
+                                     'pool_priority_limits',
+                                     'pool_priority_weights',
+                                     'pool_max_waiters')
 
 
+class AioPooledMySQLConnection(PooledMySQLConnection):
+    """Class holding a MySQL connection checked out of a MySQLConPool"""
+
+    def close(self):
+        """Give the connection back to the pool
+
+        Resetting the session, which needs the network, and queuing the
+        connection again is done in a task. The task is returned so
+        callers can wait for the connection to be back in the pool using
+        'yield from cnx.close()'; calling close() alone is enough though.
+
+        Returns an asyncio.Task or None when already closed.
+        """
+        cnx = self._cnx
+        if cnx is None:
+            return None
+        self._cnx = None
+        # pylint: disable=W0212
+        return self._cnx_pool._loop.create_task(self._cnx_pool._check_in(cnx))
+        # pylint: enable=W0212
+
+
+class _PoolConnectionContext(object):
+    """Asynchronous context manager returned by MySQLConPool.acquire()"""
+
+    def __init__(self, pool, timeout=None, priority=0):
+        self._pool = pool
+        self._timeout = timeout
+        self._priority = priority
+        self._cnx = None
+
+    @asyncio.coroutine
+    def __aenter__(self):
+        self._cnx = yield from self._pool.get_connection(
+            timeout=self._timeout, priority=self._priority)
+        return self._cnx
+
+    @asyncio.coroutine
+    def __aexit__(self, exc_type, exc, tb):
+        task = self._cnx.close()
+        self._cnx = None
+        if task is not None:
+            yield from task
+
+
+class _WaiterQueue(object):
+    """get_connection() calls waiting for a connection, by priority
+
+    Lower priority values are more urgent. Waiters of the same priority
+    are served first come, first served. Without weights, a waiter is
+    only served when no more urgent one is waiting. With weights, a dict
+    of priority to weight (1 when missing), the priorities having waiters
+    are served in proportion to their weights, so less urgent waiters are
+    slowed down but not starved.
+    """
+
+    def __init__(self, weights=None):
+        self._weights = weights
+        self._queues = {}
+        self._priorities = {}
+        self._passes = {}
+
+    def __len__(self):
+        return len(self._priorities)
+
+    def append(self, waiter, priority=0):
+        """Queue waiter behind the others of its priority"""
+        queue = self._queues.get(priority)
+        if queue is None:
+            queue = self._queues[priority] = deque()
+        if self._weights and not queue:
+            # Time spent without waiters does not count as credit
+            passes = [self._passes.get(prio, 0.0)
+                      for prio, other in self._queues.items() if other]
+            if passes:
+                self._passes[priority] = max(
+                    self._passes.get(priority, 0.0), min(passes))
+        queue.append(waiter)
+        self._priorities[waiter] = priority
+
+    def remove(self, waiter):
+        """Take waiter out of the queue
+
+        Raises ValueError when waiter is not queued.
+        """
+        try:
+            priority = self._priorities.pop(waiter)
+        except KeyError:
+            raise ValueError("Waiter not queued")
+        self._queues[priority].remove(waiter)
+
+    def popleft(self):
+        """Remove and return the waiter to serve next
+
+        Raises IndexError when nobody is waiting.
+        """
+        busy = [prio for prio, queue in self._queues.items() if queue]
+        if not busy:
+            raise IndexError("No waiters")
+        if self._weights:
+            priority = min(busy, key=lambda prio: (self._passes.get(prio, 0.0),
+                                                   prio))
+            self._passes[priority] = self._passes.get(priority, 0.0) + (
+                1.0 / self._weights.get(priority, 1))
+        else:
+            priority = min(busy)
+        waiter = self._queues[priority].popleft()
+        del self._priorities[waiter]
+        return waiter
+
+    def least_urgent(self):
+        """Returns a tuple (priority, waiter) of the waiter to shed first
+
+        This is the last queued waiter of the least urgent priority, or
+        None when nobody is waiting.
+        """
+        for priority in sorted(self._queues, reverse=True):
+            for waiter in reversed(self._queues[priority]):
+                if not waiter.done():
+                    return (priority, waiter)
+        return None
+
 
 class MySQLConPool(MySQLConnectionPool):
-    """Class derived MySqlConnectionPool,make for async acesss"""
-    def __init__(self, pool_size=5, pool_name=None, pool_reset_session=True, **kwargs):
+    """Class derived MySqlConnectionPool,make for async acesss
+
+    The pool holds between min_size and max_size (pool_size) connections.
+    Idle connections are kept in a deque. When none is available,
+    get_connection() waits in a queue of waiters ordered by priority, and
+    new connections
+    are opened in the background as long as the pool is below max_size.
+    Every connection given back to the pool is handed to exactly one
+    waiter. Connections idle for longer than idle_timeout are closed,
+    down to min_size.
+    """
+    def __init__(self, pool_size=5, pool_name=None, pool_reset_session=True,
+                 pool_timeout=None, pool_min_size=0, pool_max_size=None,
+                 pool_idle_timeout=None, pool_connect_concurrency=4,
+                 pool_check_interval=None, pool_stale_timeout=None,
+                 pool_max_lifetime=None, pool_max_uses=None,
+                 pool_lifetime_jitter=0.2, pool_priority_limits=None,
+                 pool_priority_weights=None, pool_max_waiters=None,
+                 **kwargs):
         """Initialize
 
         Initialize a MySQL connection pool with a maximum number of
-        connections set to pool_size. The rest of the keywords
-        arguments, kwargs, are configuration arguments for MySQLConnection
-        instances.
+        connections set to pool_max_size, or pool_size when not given. The
+        rest of the keywords arguments, kwargs, are configuration arguments
+        for MySQLConnection instances.
+
+        pool_min_size connections are opened in the background right away
+        and kept open. pool_idle_timeout is the number of seconds after
+        which idle connections above pool_min_size are closed; None keeps
+        them open. At most pool_connect_concurrency connections are being
+        opened at the same time.
+
+        By default get_connection() sends a PING before returning a
+        connection. When pool_stale_timeout is set, only connections idle
+        for at least that many seconds are pinged; others are checked
+        locally. When pool_check_interval is set, a background task pings
+        the idle connections every pool_check_interval seconds. Broken
+        connections are replaced in the background.
+
+        Connections are retired when given back after being open for
+        pool_max_lifetime seconds or checked out pool_max_uses times. Each
+        connection gets limits lowered by a random fraction of up to
+        pool_lifetime_jitter, so connections opened together are not
+        retired together. A replacement is opened before the retired
+        connection is closed.
+
+        get_connection() takes a priority, an integer; lower values are
+        more urgent. pool_priority_limits maps priorities to the maximum
+        number of connections checked out with that priority at the same
+        time. Waiting callers are served strictly by priority, or, when
+        pool_priority_weights maps priorities to weights, in proportion to
+        the weights. When pool_max_waiters callers are waiting, a new
+        caller is shed with a PoolError, unless it is more urgent than
+        a waiting caller, which is then shed instead.
+
+        Counters, histograms and gauges describing the pool are kept in
+        the metrics attribute, see PoolMetrics.
+
+        pool_timeout is the default number of seconds get_connection()
+        waits for a connection; None waits as long as it takes.
         """
+        self._loop = kwargs.pop('loop', None) or asyncio.get_event_loop()
         self._pool_size = None
         self._pool_name = None
         self._reset_session = pool_reset_session
-        self._set_pool_size(pool_size)
+        self._timeout = pool_timeout
+        self._set_pool_size(pool_max_size or pool_size)
+        if not 0 <= pool_min_size <= self._pool_size:
+            raise AttributeError(
+                "Pool min size should be between 0 and {0}".format(
+                    self._pool_size))
+        self._min_size = pool_min_size
+        self._idle_timeout = pool_idle_timeout
+        self._check_interval = pool_check_interval
+        self._stale_timeout = pool_stale_timeout
+        self._max_lifetime = pool_max_lifetime
+        self._max_uses = pool_max_uses
+        self._lifetime_jitter = min(max(pool_lifetime_jitter, 0.0), 1.0)
+        if pool_priority_weights and min(pool_priority_weights.values()) <= 0:
+            raise AttributeError("Pool priority weights should be positive")
+        self._priority_slots = dict(
+            (priority, asyncio.Semaphore(limit, loop=self._loop))
+            for priority, limit in (pool_priority_limits or {}).items())
+        self._max_waiters = pool_max_waiters
         self._set_pool_name(pool_name or generate_pool_name(**kwargs))
         self._cnx_config = {}
-        self._cnx_queue = queue.Queue(self._pool_size)
+        self._idle = deque()
+        self._waiters = _WaiterQueue(pool_priority_weights)
+        self._size = 0
+        self._opening = 0
+        self._tasks = set()
+        self._reaper = None
+        self._checker = None
+        self._closed = False
+        self._connect_limit = asyncio.Semaphore(
+            max(1, pool_connect_concurrency), loop=self._loop)
         self._config_version = uuid4()
+        self.metrics = PoolMetrics(self)
 
         if kwargs:
             self.set_config(**kwargs)
-            cnt = 0
-            while cnt < self._pool_size:
-                self.add_connection()
-                cnt += 1
+            self.start()
+
+    def start(self):
+        """Start the background tasks of the pool and fill it
+
+        Opening pool_min_size connections is started in the background; the
+        returned task can be awaited to wait for them.
+
+        Returns an asyncio.Task.
+        """
+        self._closed = False
+        if self._idle_timeout and self._reaper is None:
+            self._reaper = self._loop.create_task(self._reap_idle())
+        if self._check_interval and self._checker is None:
+            self._checker = self._loop.create_task(self._check_idle())
+        return self._spawn(self.fill())
+
+    @asyncio.coroutine
+    def fill(self, count=None):
+        """Open connections until the pool holds count connections
+
+        Connections are opened concurrently, pool_connect_concurrency at a
+        time. When count is None, the pool is filled up to pool_min_size.
+        The pool never grows beyond its maximum size.
+
+        Raises the connect error when none of the connections could be
+        opened.
+
+        Returns the number of connections opened.
+        """
+        if count is None:
+            count = self._min_size
+        tasks = self._open_connections(count - self._size)
+        if not tasks:
+            return 0
+        yield from asyncio.wait(tasks, loop=self._loop)
+        failed = [task.result() for task in tasks if task.result()]
+        if len(failed) == len(tasks):
+            raise failed[0]
+        return len(tasks) - len(failed)
+
+    @property
+    def min_size(self):
+        """Number of connections kept open"""
+        return self._min_size
+
+    @property
+    def max_size(self):
+        """Maximum number of connections"""
+        return self._pool_size
+
+    @property
+    def size(self):
+        """Number of connections, including the ones being opened"""
+        return self._size
+
+    def _spawn(self, coro):
+        """Run coro in a background task owned by the pool"""
+        task = self._loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    @asyncio.coroutine
+    def _new_connection(self):
+        """Create and connect a new AioMySQLConnection
+
+        Returns a AioMySQLConnection instance.
+        """
+        cnx = AioMySQLConnection(loop=self._loop, **self._cnx_config)
+        # pylint: disable=W0201,W0212
+        cnx._pool_config_version = self._config_version
+        # pylint: enable=W0201,W0212
+        try:
+            yield from cnx.connect()
+        except errors.Error:
+            self.metrics.incr('connect_failures')
+            raise
+        self.metrics.incr('connections_created')
+        self._set_limits(cnx)
+        if (self._reset_session and self._cnx_config.get('compress')
+                and cnx.get_server_version() < (5, 7, 3)):
+            cnx.disconnect()
+            raise errors.NotSupportedError("Pool reset session is "
+                                           "not supported with "
+                                           "compression for MySQL "
+                                           "server version 5.7.2 "
+                                           "or earlier.")
+        return cnx
+
+    def _set_limits(self, cnx):
+        """Set the jittered lifetime and number of uses of a connection"""
+        jitter = self._lifetime_jitter
+        # pylint: disable=W0201,W0212
+        cnx._pool_uses = 0
+        cnx._pool_lifetime = None
+        cnx._pool_use_limit = None
+        if self._max_lifetime:
+            cnx._pool_lifetime = self._max_lifetime * (
+                1.0 - random.uniform(0.0, jitter))
+        if self._max_uses:
+            cnx._pool_use_limit = random.randint(
+                max(1, int(math.ceil(self._max_uses * (1.0 - jitter)))),
+                self._max_uses)
+        # pylint: enable=W0201,W0212
+
+    def _expired(self, cnx):
+        """Reports whether a connection reached its lifetime or uses
+
+        Returns True or False.
+        """
+        # pylint: disable=W0212
+        limit = getattr(cnx, '_pool_use_limit', None)
+        if limit and cnx._pool_uses >= limit:
+            return True
+        limit = getattr(cnx, '_pool_lifetime', None)
+        age = cnx.connection_age
+        return bool(limit and age is not None and age >= limit)
+
+    @asyncio.coroutine
+    def _retire(self, cnx):
+        """Replace a connection which reached its lifetime or uses
+
+        The replacement is opened first, so the pool does not shrink.
+        When it can not be opened, the old connection is closed anyway.
+        """
+        try:
+            with (yield from self._connect_limit):
+                new_cnx = yield from self._new_connection()
+        except (Exception, asyncio.CancelledError):  # pylint: disable=W0703
+            self._close_connection(cnx)
+            return
+        try:
+            cnx.disconnect()
+        except errors.Error:
+            pass
+        self.metrics.incr('connections_closed')
+        if self._closed:
+            self._close_connection(new_cnx)
+        else:
+            self._queue_connection(new_cnx)
+
+    @asyncio.coroutine
+    def _open_one(self):
+        """Open a connection in the background and give it to the pool
+
+        When connecting fails, the error is passed on to the longest
+        waiting get_connection() call, if any.
+
+        Returns the connect error, or None on success.
+        """
+        try:
+            with (yield from self._connect_limit):
+                cnx = yield from self._new_connection()
+        except (Exception, asyncio.CancelledError) as err:  # pylint: disable=W0703
+            self._size -= 1
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if not waiter.done():
+                    waiter.set_exception(err)
+                    break
+            return err
+        finally:
+            self._opening -= 1
+        self._queue_connection(cnx)
+        return None
+
+    def _open_connections(self, count):
+        """Start opening count connections, without exceeding max_size
+
+        Returns the list of tasks opening the connections.
+        """
+        count = min(count, self._pool_size - self._size)
+        tasks = []
+        for _ in range(count):
+            self._size += 1
+            self._opening += 1
+            tasks.append(self._spawn(self._open_one()))
+        return tasks
+
+    def _grow(self):
+        """Open connections for waiters not covered by pending opens"""
+        self._open_connections(len(self._waiters) - self._opening)
+
+    def _close_connection(self, cnx, replace=False):
+        """Close a connection owned by the pool and refill it
+
+        Replacements are opened concurrently in the background to keep
+        min_size connections and to serve waiting callers. When replace is
+        True, at least one replacement is opened.
+        """
+        self._size -= 1
+        try:
+            cnx.disconnect()
+        except errors.Error:
+            pass
+        self.metrics.incr('connections_closed')
+        if self._closed:
+            return
+        self._open_connections(max(self._min_size - self._size,
+                                   len(self._waiters) - self._opening,
+                                   1 if replace else 0))
+
+    @asyncio.coroutine
+    def _is_usable(self, cnx):
+        """Reports whether a pooled connection can be handed out
+
+        The transport is checked locally first. A PING is only sent when
+        the connection was idle for pool_stale_timeout seconds or more, or
+        always when no pool_stale_timeout is set.
+
+        Returns True or False.
+        """
+        # pylint: disable=W0212
+        sock = cnx._socket
+        if not sock or not sock.is_open():
+            return False
+        idle = sock.idle_time()
+        if self._stale_timeout is not None and idle is not None \
+                and idle < self._stale_timeout:
+            return True
+        return (yield from cnx.is_connected())
+
+    @asyncio.coroutine
+    def _validate_idle(self, cnx):
+        """Ping an idle connection taken out of the pool and put it back
+
+        A broken connection is closed and replaced in the background.
+        """
+        if not (yield from self._is_usable(cnx)) or self._closed:
+            self._close_connection(cnx, replace=True)
+            return
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(cnx)
+                return
+        # Keep its place among the least recently used connections
+        self._idle.appendleft(cnx)
+
+    @asyncio.coroutine
+    def _check_idle(self):
+        """Validate the idle connections every check_interval seconds
+
+        Only connections which received nothing from the MySQL server
+        since the previous round are pinged, all of them concurrently.
+        """
+        while True:
+            yield from asyncio.sleep(self._check_interval, loop=self._loop)
+            checks = []
+            for cnx in list(self._idle):
+                # pylint: disable=W0212
+                idle = cnx._socket.idle_time() if cnx._socket else None
+                if idle is None or idle >= self._check_interval:
+                    self._idle.remove(cnx)
+                    checks.append(self._spawn(self._validate_idle(cnx)))
+            if checks:
+                yield from asyncio.wait(checks, loop=self._loop)
+
+    @asyncio.coroutine
+    def _reap_idle(self):
+        """Close connections which were idle longer than idle_timeout
+
+        The least recently used idle connections are at the left of the
+        deque since get_connection() takes from the right.
+        """
+        interval = max(self._idle_timeout / 2.0, 0.1)
+        while True:
+            yield from asyncio.sleep(interval, loop=self._loop)
+            now = self._loop.time()
+            while (self._idle and self._size > self._min_size
+                   and now - self._idle[0]._pool_idle_since  # pylint: disable=W0212
+                   > self._idle_timeout):
+                self._close_connection(self._idle.popleft())
+
+    @asyncio.coroutine
+    def close(self):
+        """Stop background tasks and close all idle connections
+
+        Callers waiting for a connection get a PoolError. Connections
+        which are checked out are closed when given back.
+        """
+        tasks = list(self._tasks)
+        for task in (self._reaper, self._checker):
+            if task is not None:
+                tasks.append(task)
+        self._reaper = self._checker = None
+        self._closed = True
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_exception(errors.PoolError(
+                    "Failed getting connection; pool closed"))
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            yield from asyncio.wait(tasks, loop=self._loop)
+        self._min_size = 0
+        closed = self._remove_connections()
+        self._size -= closed
+        self.metrics.incr('connections_closed', closed)
+
+    def _queue_connection(self, cnx):
+        """Put connection back in the pool
+
+        The connection is handed to the longest waiting get_connection()
+        call, or kept as idle connection when nobody is waiting.
+
+        Raises PoolError on errors.
+        """
+        if not isinstance(cnx, AioMySQLConnection):
+            raise errors.PoolError(
+                "Connection instance not subclass of AioMySQLConnection.")
+
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(cnx)
+                return
+
+        if len(self._idle) >= self._pool_size:
+            raise errors.PoolError("Failed adding connection; queue is full")
+        # pylint: disable=W0201,W0212
+        cnx._pool_idle_since = self._loop.time()
+        # pylint: enable=W0201,W0212
+        self._idle.append(cnx)
 
     def add_connection(self, cnx=None):
         """Add a connection to the pool
@@ -84,37 +620,23 @@ class MySQLConPool(MySQLConnectionPool):
         connection can be added (maximum reached) or when the connection
         can not be instantiated.
         """
-        with CONNECTION_POOL_LOCK:
-            if not self._cnx_config:
-                raise errors.PoolError(
-                    "Connection configuration not available")
+        if not self._cnx_config:
+            raise errors.PoolError(
+                "Connection configuration not available")
 
-            if self._cnx_queue.full():
-                raise errors.PoolError(
-                    "Failed adding connection; queue is full")
+        if self._size >= self._pool_size:
+            raise errors.PoolError(
+                "Failed adding connection; queue is full")
 
-            if not cnx:
-                cnx = AioMySQLConnection(**self._cnx_config)
-                try:
-                    if (self._reset_session and self._cnx_config['compress']
-                            and cnx.get_server_version() < (5, 7, 3)):
-                        raise errors.NotSupportedError("Pool reset session is "
-                                                       "not supported with "
-                                                       "compression for MySQL "
-                                                       "server version 5.7.2 "
-                                                       "or earlier.")
-                except KeyError:
-                    pass
-
-                # pylint: disable=W0201,W0212
-                cnx._pool_config_version = self._config_version
-                # pylint: enable=W0201,W0212
-            else:
-                if not isinstance(cnx, AioMySQLConnection):
-                    raise errors.PoolError(
-                        "Connection instance not subclass of AioMySQLConnection.")
+        if not cnx:
+            # Replaced by a connected one on its first checkout
+            cnx = AioMySQLConnection(loop=self._loop, **self._cnx_config)
+            # pylint: disable=W0201,W0212
+            cnx._pool_config_version = self._config_version
+            # pylint: enable=W0201,W0212
 
-            self._queue_connection(cnx)
+        self._queue_connection(cnx)
+        self._size += 1
 
     def set_config(self, **kwargs):
         """Set the connection configuration for MySQLConnection instances
@@ -128,50 +650,287 @@ class MySQLConPool(MySQLConnectionPool):
         if not kwargs:
             return
 
-        with CONNECTION_POOL_LOCK:
+        try:
+            test_cnx = AioMySQLConnection(loop=self._loop)
+            test_cnx.config(**kwargs)
+            self._cnx_config = kwargs
+            self._config_version = uuid4()
+        except AttributeError as err:
+            raise errors.PoolError(
+                "Connection configuration not valid: {0}".format(err))
+
+    def _remove_connections(self):
+        """Close all idle connections
+
+        Returns the number of connections removed.
+        """
+        cnt = 0
+        while self._idle:
+            cnx = self._idle.popleft()
             try:
-                test_cnx = AioMySQLConnection()
-                test_cnx.config(**kwargs)
-                self._cnx_config = kwargs
-                self._config_version = uuid4()
-            except AttributeError as err:
+                cnx.disconnect()
+            except errors.Error:
+                pass
+            cnt += 1
+        return cnt
+
+    def _shed(self, priority):
+        """Make room for a waiter when pool_max_waiters are waiting
+
+        The least urgent waiter is shed when it is less urgent than
+        priority.
+
+        Raises PoolError when the new waiter is shed itself.
+        """
+        if self._max_waiters is None or len(self._waiters) < self._max_waiters:
+            return
+        self.metrics.incr('shed')
+        victim = self._waiters.least_urgent()
+        if victim is None or victim[0] <= priority:
+            raise errors.PoolError(
+                "Failed getting connection; {0} callers waiting with "
+                "priority {1} or more urgent".format(len(self._waiters),
+                                                      priority))
+        self._waiters.remove(victim[1])
+        victim[1].set_exception(errors.PoolError(
+            "Failed getting connection; shed for a caller with priority "
+            "{0}".format(priority)))
+
+    @asyncio.coroutine
+    def _wait_for_connection(self, timeout, priority=0):
+        """Wait until a connection is given back to the pool
+
+        Raises PoolError when no connection became available within
+        timeout seconds, or when the waiter was shed.
+
+        Returns a AioMySQLConnection instance.
+        """
+        self._shed(priority)
+        waiter = asyncio.Future(loop=self._loop)
+        self._waiters.append(waiter, priority)
+        self._grow()
+        try:
+            return (yield from asyncio.wait_for(waiter, timeout,
+                                                loop=self._loop))
+        except (asyncio.TimeoutError, asyncio.CancelledError) as err:
+            # A connection might have been handed over right before
+            if waiter.done() and not waiter.cancelled():
+                self._queue_connection(waiter.result())
+            if isinstance(err, asyncio.TimeoutError):
+                self.metrics.incr('timeouts')
                 raise errors.PoolError(
-                    "Connection configuration not valid: {0}".format(err))
+                    "Failed getting connection; pool exhausted, "
+                    "waited {0} seconds with priority {1}".format(
+                        timeout, priority))
+            raise
+        finally:
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
+
+    @asyncio.coroutine
+    def _acquire_slot(self, priority, timeout):
+        """Wait until priority is below its limit of connections
+
+        Raises PoolError when the limit was not freed within timeout
+        seconds.
+
+        Returns the semaphore acquired, or None when priority has no limit.
+        """
+        slot = self._priority_slots.get(priority)
+        if slot is None:
+            return None
+        try:
+            yield from asyncio.wait_for(slot.acquire(), timeout,
+                                        loop=self._loop)
+        except asyncio.TimeoutError:
+            self.metrics.incr('timeouts')
+            raise errors.PoolError(
+                "Failed getting connection; limit of connections with "
+                "priority {0} reached, waited {1} seconds".format(
+                    priority, timeout))
+        return slot
 
     @asyncio.coroutine
-    def get_connection(self):
+    def get_connection(self, timeout=None, priority=0):
         """Get a connection from the pool
 
         This method returns an PooledMySQLConnection instance which
         has a reference to the pool that created it, and the next available
         MySQL connection.
 
-        When the MySQL connection is not connect, a reconnect is attempted.
+        When all connections are in use, this method waits until one is
+        given back, at most timeout seconds (or pool_timeout when timeout
+        is None). Waiters are served by priority, lower values first, and
+        first come, first served within a priority. When the priority has
+        a limit of connections, waiting for the limit counts in timeout.
 
-        Raises PoolError on errors.
+        Broken connections are replaced in the background and the next
+        available connection is used. When the configuration of the pool
+        changed, a reconnect is attempted.
+
+        Raises PoolError on errors, and when the caller was shed.
 
         Returns a PooledMySQLConnection instance.
         """
-        with CONNECTION_POOL_LOCK:
-            try:
-                cnx = self._cnx_queue.get(block=False)
-            except queue.Empty:
-                raise errors.PoolError(
-                    "Failed getting connection; pool exhausted")
+        if timeout is None:
+            timeout = self._timeout
+        if self._closed:
+            raise errors.PoolError("Failed getting connection; pool closed")
+        started = self._loop.time()
+        slot = yield from self._acquire_slot(priority, timeout)
+        try:
+            cnx = yield from self._checkout(timeout, priority, started)
+        except (Exception, asyncio.CancelledError):
+            if slot is not None:
+                slot.release()
+            raise
+        # pylint: disable=W0201,W0212
+        cnx._pool_priority = priority
+        return AioPooledMySQLConnection(self, cnx)
 
-            # pylint: disable=W0201,W0212
-            if not (yield from cnx.is_connected()) \
-                    or self._config_version != cnx._pool_config_version:
+    @asyncio.coroutine
+    def _checkout(self, timeout, priority, started):
+        """Take a usable connection out of the pool
+
+        Returns a AioMySQLConnection instance.
+        """
+        if timeout is not None:
+            timeout = max(0, timeout - (self._loop.time() - started))
+        # pylint: disable=W0201,W0212
+        while True:
+            if self._idle:
+                cnx = self._idle.pop()
+            else:
+                cnx = yield from self._wait_for_connection(timeout, priority)
+
+            if self._config_version != cnx._pool_config_version:
                 cnx.config(**self._cnx_config)
                 try:
                     yield from cnx.reconnect()
                 except errors.InterfaceError:
                     # Failed to reconnect, give connection back to pool
+                    self.metrics.incr('connect_failures')
                     self._queue_connection(cnx)
                     raise
+                self.metrics.incr('connections_created')
                 cnx._pool_config_version = self._config_version
-            else:
-                print("get a pooled connector. current pool size is:", self._cnx_queue.qsize() )
+                self._set_limits(cnx)
+                break
+            if (yield from self._is_usable(cnx)):
+                break
+            # Replaced in the background; try the next one
+            self._close_connection(cnx, replace=True)
+
+        cnx._session_dirty = False
+        cnx._pool_uses = getattr(cnx, '_pool_uses', 0) + 1
+        cnx._pool_checkout_at = self._loop.time()
+        self.metrics.incr('checkouts')
+        self.metrics.observe('checkout_wait', cnx._pool_checkout_at - started)
+        return cnx
+
+    def acquire(self, timeout=None, priority=0):
+        """Get a connection for use in an 'async with' statement
+
+        The connection is given back to the pool when leaving the block:
+            async with pool.acquire() as cnx:
+                cur = await cnx.cursor()
+
+        Returns an asynchronous context manager.
+        """
+        return _PoolConnectionContext(self, timeout, priority)
+
+    @asyncio.coroutine
+    def run_in_transaction(self, func, retries=3, backoff=0.05,
+                           max_backoff=2.0, fresh_connection=False,
+                           timeout=None, priority=0, **kwargs):
+        """Run func in a transaction on a pooled connection
 
-            return PooledMySQLConnection(self, cnx)
+        Works like AioMySQLConnection.run_in_transaction(), func being
+        called with the PooledMySQLConnection. When fresh_connection is
+        True, the connection is given back after a deadlock or lock wait
+        timeout and the next attempt takes another one. timeout and
+        priority are used getting connections.
 
+        Retries, deadlocks, lock wait timeouts and transactions failing
+        after all retries are counted in the metrics.
+
+        Returns what func returns.
+        """
+        delays = retry_delays(backoff, max_backoff)
+        attempt = 0
+        cnx = None
+        try:
+            while True:
+                if cnx is None:
+                    cnx = yield from self.get_connection(timeout=timeout,
+                                                         priority=priority)
+                try:
+                    # pylint: disable=W0212
+                    return (yield from cnx._transaction_attempt(func, cnx,
+                                                                kwargs))
+                except errors.Error as err:
+                    counter = RETRY_TRANSACTION_ERRORS.get(err.errno)
+                    if counter is None:
+                        raise
+                    self.metrics.incr(counter)
+                    if attempt >= retries:
+                        self.metrics.incr('transaction_retries_exhausted')
+                        raise
+                attempt += 1
+                self.metrics.incr('transaction_retries')
+                if fresh_connection:
+                    cnx.close()
+                    cnx = None
+                yield from asyncio.sleep(next(delays), loop=self._loop)
+        finally:
+            if cnx is not None:
+                cnx.close()
+
+    @asyncio.coroutine
+    def _check_in(self, cnx):
+        """Reset the session of a returned connection and queue it again
+
+        The session is only reset when it was modified since the connection
+        was checked out. Connections past their lifetime or number of uses
+        are retired instead, unless somebody is waiting for a connection.
+        A connection whose last command was cancelled is only queued again
+        once the rest of the response was discarded; when that failed, it
+        is replaced. Results left unread are discarded. When discarding or
+        resetting fails, the connection is closed and a replacement is
+        opened when needed.
+        """
+        # pylint: disable=W0212
+        self.metrics.incr('checkins')
+        checkout_at = getattr(cnx, '_pool_checkout_at', None)
+        if checkout_at is not None:
+            self.metrics.observe('hold_time', self._loop.time() - checkout_at)
+        slot = self._priority_slots.get(getattr(cnx, '_pool_priority', None))
+        cnx._pool_priority = None
+        # pylint: enable=W0212
+        if slot is not None:
+            slot.release()
+        if self._closed:
+            self._close_connection(cnx)
+            return
+        # pylint: disable=W0212
+        yield from cnx._wait_drained()
+        if cnx._socket is not None and not cnx.is_connected_locally():
+            self._close_connection(cnx, replace=True)
+            return
+        # pylint: enable=W0212
+        if not self._waiters and self._expired(cnx):
+            self._spawn(self._retire(cnx))
+            return
+        try:
+            # pylint: disable=W0212
+            if cnx.unread_result or cnx._have_next_result:
+                yield from cnx.discard_result()
+            # pylint: enable=W0212
+            if self._reset_session:
+                yield from cnx.reset_session(if_modified=True)
+        except errors.Error:
+            self._close_connection(cnx)
+        else:
+            self._queue_connection(cnx)
@@ -23,10 +23,23 @@
 
 """Implements the MySQL Client/Server protocol
 """
-from mysql.connector import utils
+import struct
+
+from mysql.connector import errors, utils
 from mysql.connector.protocol import MySQLProtocol
 import asyncio
 
+# Session state tracking, not available in mysql.connector.constants
+CLIENT_SESSION_TRACK = 1 << 23
+SERVER_SESSION_STATE_CHANGED = 1 << 14
+
+SESSION_TRACK_SYSTEM_VARIABLES = 0
+SESSION_TRACK_SCHEMA = 1
+SESSION_TRACK_STATE_CHANGE = 2
+SESSION_TRACK_GTIDS = 3
+SESSION_TRACK_TRANSACTION_CHARACTERISTICS = 4
+SESSION_TRACK_TRANSACTION_STATE = 5
+
 
 class AioMySQLProtocol(MySQLProtocol):
     """Implements MySQL client/server protocol
@@ -34,12 +47,76 @@ class AioMySQLProtocol(MySQLProtocol):
     Create and parses MySQL packets.
     """
 
+    def parse_ok(self, packet, session_track=False):
+        """Parse a MySQL OK-packet
+
+        When session_track is True, CLIENT_SESSION_TRACK was negotiated and
+        the session state changes sent by the server are returned as a list
+        of (type, value) tuples using the key 'session_state'.
+        """
+        if not session_track:
+            return super(AioMySQLProtocol, self).parse_ok(packet)
+
+        if packet[4] != 0:
+            raise errors.InterfaceError("Failed parsing OK packet (invalid).")
+
+        ok_packet = {'field_count': packet[4], 'info_msg': '',
+                     'session_state': []}
+        try:
+            (packet, ok_packet['affected_rows']) = utils.read_lc_int(packet[5:])
+            (packet, ok_packet['insert_id']) = utils.read_lc_int(packet)
+            (ok_packet['status_flag'],
+             ok_packet['warning_count']) = struct.unpack('<HH',
+                                                         bytes(packet[0:4]))
+            packet = packet[4:]
+            if packet:
+                (packet, info_msg) = utils.read_lc_string(packet)
+                ok_packet['info_msg'] = (info_msg or b'').decode('utf-8')
+            if packet and (ok_packet['status_flag']
+                           & SERVER_SESSION_STATE_CHANGED):
+                (packet, state) = utils.read_lc_string(packet)
+                ok_packet['session_state'] = self.parse_session_state(state)
+        except (ValueError, IndexError, struct.error):
+            raise errors.InterfaceError("Failed parsing OK packet.")
+        return ok_packet
+
+    def parse_session_state(self, data):
+        """Parse the session state information of an OK-packet
+
+        System variables are returned as (type, (name, value)), the schema,
+        state change and transaction information as (type, value) and
+        other types as (type, raw bytes).
+
+        Returns a list of tuples.
+        """
+        changes = []
+        while data:
+            kind = data[0]
+            (data, value) = utils.read_lc_string(data[1:])
+            if kind == SESSION_TRACK_SYSTEM_VARIABLES:
+                while value:
+                    (value, name) = utils.read_lc_string(value)
+                    (value, var) = utils.read_lc_string(value)
+                    changes.append((kind, (name.decode('utf-8'),
+                                           var.decode('utf-8'))))
+            elif kind in (SESSION_TRACK_SCHEMA, SESSION_TRACK_STATE_CHANGE,
+                          SESSION_TRACK_TRANSACTION_CHARACTERISTICS,
+                          SESSION_TRACK_TRANSACTION_STATE):
+                (_, var) = utils.read_lc_string(value)
+                changes.append((kind, var.decode('utf-8')))
+            else:
+                changes.append((kind, bytes(value)))
+        return changes
+
     @asyncio.coroutine
     def read_text_result(self, sock, count=1):
         """Read MySQL text result
 
         Reads all or given number of rows from the socket.
 
+        Raises the error of an Error packet ending the result, for
+        example when the statement was killed.
+
         Returns a tuple with 2 elements: a list with all rows and
         the EOF packet.
         """
@@ -64,6 +141,8 @@ class AioMySQLProtocol(MySQLProtocol):
                 else:
                     datas.append(packet[4:])
                 rowdata = utils.read_lc_string_list(b''.join(datas))
+            elif packet[4] == 255:
+                raise errors.get_exception(packet)
             elif packet[4] == 254:
                 eof = self.parse_eof(packet)
                 rowdata = None
@@ -80,6 +159,8 @@ class AioMySQLProtocol(MySQLProtocol):
         """Read MySQL binary protocol result
 
         Reads all or given number of binary resultset rows from the socket.
+
+        Raises the error of an Error packet ending the result.
         """
         rows = []
         eof = None
@@ -91,6 +172,8 @@ class AioMySQLProtocol(MySQLProtocol):
             if i == count:
                 break
             packet = yield from sock.recv()
+            if packet[4] == 255:
+                raise errors.get_exception(packet)
             if packet[4] == 254:
                 eof = self.parse_eof(packet)
                 values = None
@@ -0,0 +1,297 @@
+# MySQL Connector/Python - MySQL driver written in Python.
+# Copyright (c) 2014, Oracle and/or its affiliates. All rights reserved.
+
+# MySQL Connector/Python is licensed under the terms of the GPLv2
+# <http://www.gnu.org/licenses/old-licenses/gpl-2.0.html>, like most
+# MySQL Connectors. There are special exceptions to the terms and
+# conditions of the GPLv2 as it is applied to this software, see the
+# FOSS License Exception
+# <http://www.mysql.com/about/legal/licensing/foss-exception.html>.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Routing reads to replica pools and everything else to the primary
+"""
+
+import re
+import random
+from bisect import bisect_right
+
+from mysql.connector import errors
+from mysql.connector.constants import ServerFlag
+import asyncio
+
+RE_SQL_COMMENT = re.compile(r'^\s*(?:/\*.*?\*/|(?:--\s|#)[^\n]*\n?)', re.S)
+_RE_SQL_COMMENT_BYTES = re.compile(RE_SQL_COMMENT.pattern.encode('ascii'),
+                                   re.S)
+RE_SQL_READ = re.compile(
+    r'^\s*\(*\s*(?:SELECT|SHOW|DESCRIBE|DESC|EXPLAIN|WITH)\b', re.I)
+# Quoted strings and identifiers, which are left out of the checks below
+RE_SQL_QUOTED = re.compile(
+    r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"|`(?:[^`]|``)*`", re.S)
+# Reads which lock rows, write files, depend on the session, change data
+# in a WITH statement or are followed by other statements
+RE_SQL_PRIMARY_READ = re.compile(
+    r'\bFOR\s+(?:UPDATE|SHARE)\b|\bLOCK\s+IN\s+SHARE\s+MODE\b'
+    r'|\bINTO\s+(?:OUTFILE|DUMPFILE)\b|@|;\s*\S'
+    r'|\b(?:INSERT|UPDATE|DELETE|REPLACE)\b'
+    r'|\b(?:LAST_INSERT_ID|GET_LOCK|RELEASE_LOCK|RELEASE_ALL_LOCKS'
+    r'|IS_USED_LOCK|IS_FREE_LOCK|FOUND_ROWS|ROW_COUNT|CONNECTION_ID'
+    r'|DATABASE|SCHEMA)\s*\(', re.I)
+
+
+def strip_comments(operation):
+    """Returns operation, str or bytes, without its leading comments"""
+    regex = _RE_SQL_COMMENT_BYTES if isinstance(
+        operation, (bytes, bytearray)) else RE_SQL_COMMENT
+    while True:
+        match = regex.match(operation)
+        if not match:
+            return operation
+        operation = operation[match.end():]
+
+
+def is_read_statement(operation):
+    """Reports whether a statement can be sent to a replica
+
+    Single statements reading data without locking rows, writing files
+    or depending on the state of the session, such as user variables or
+    LAST_INSERT_ID(), are reads; quoted strings are not looked at.
+    Everything else, including statements which can not be classified,
+    goes to the primary.
+
+    Returns True or False.
+    """
+    if isinstance(operation, (bytes, bytearray)):
+        operation = operation.decode('utf-8', 'replace')
+    operation = strip_comments(operation)
+    if not RE_SQL_READ.match(operation):
+        return False
+    return not RE_SQL_PRIMARY_READ.search(RE_SQL_QUOTED.sub("''", operation))
+
+
+class MySQLRouter(object):
+    """Primary pool and weighted replica pools
+
+    replicas is a sequence of MySQLConPool instances, or of (pool, weight)
+    tuples; pools without a weight get weight 1. Reads are spread over the
+    replicas proportionally to their weight. When no replica connection
+    can be had, reads go to the primary.
+
+    Sessions only send reads to replicas in autocommit mode. Since
+    autocommit is off by default, the primary pool has to be created
+    with autocommit=True for sessions to use the replicas.
+    """
+
+    def __init__(self, primary, replicas=None):
+        self._primary = primary
+        self._replicas = []
+        self._cum_weights = []
+        total = 0
+        for replica in replicas or ():
+            if isinstance(replica, tuple):
+                pool, weight = replica
+            else:
+                pool, weight = replica, 1
+            if weight < 0:
+                raise AttributeError("Replica weight can not be negative")
+            if not weight:
+                continue
+            total += weight
+            self._replicas.append(pool)
+            self._cum_weights.append(total)
+
+    @property
+    def primary(self):
+        """Pool of the primary server"""
+        return self._primary
+
+    @property
+    def replicas(self):
+        """List of the replica pools"""
+        return list(self._replicas)
+
+    def _replica_order(self):
+        """Returns the replica pools to try, in order
+
+        The first pool is picked randomly according to the weights; the
+        others follow as fallback.
+        """
+        if not self._replicas:
+            return []
+        point = random.uniform(0, self._cum_weights[-1])
+        first = min(bisect_right(self._cum_weights, point),
+                    len(self._replicas) - 1)
+        return self._replicas[first:] + self._replicas[:first]
+
+    @asyncio.coroutine
+    def get_connection(self, readonly=False, force_primary=False,
+                       timeout=None):
+        """Get a connection for reading or for writing
+
+        Connections for writing, or all when force_primary is True, come
+        from the primary pool. Read-only connections come from a replica
+        pool, falling back to the other replicas and then the primary.
+
+        Returns a PooledMySQLConnection instance.
+        """
+        if readonly and not force_primary:
+            for pool in self._replica_order():
+                try:
+                    return (yield from pool.get_connection(timeout=timeout))
+                except errors.Error:
+                    continue
+        return (yield from self._primary.get_connection(timeout=timeout))
+
+    def session(self, force_primary=False, timeout=None):
+        """Create a session routing each statement
+
+        Returns a RoutingSession instance.
+        """
+        return RoutingSession(self, force_primary=force_primary,
+                              timeout=timeout)
+
+    @asyncio.coroutine
+    def close(self):
+        """Close the primary and replica pools"""
+        for pool in [self._primary] + self._replicas:
+            yield from pool.close()
+
+
+class RoutingSession(object):
+    """Statements executed in a session are routed one by one
+
+    Reads in autocommit mode go to a replica. Writes, multiple statements,
+    statements executed while autocommit is off or the primary connection
+    is in a transaction and all statements when force_primary is set go
+    to the primary. Whether autocommit is on is taken from the primary
+    connection, or from the configuration of the primary pool before
+    one is held; with the default autocommit=False, no read goes to a
+    replica. At most one primary and one replica connection are held;
+    both are given back to their pools by close(), or when leaving an
+    'async with' block:
+
+        async with router.session() as session:
+            cur = await session.execute("SELECT ...")
+            rows = await cur.fetchall()
+    """
+
+    def __init__(self, router, force_primary=False, timeout=None):
+        self._router = router
+        self._timeout = timeout
+        self.force_primary = force_primary
+        self._primary_cnx = None
+        self._replica_cnx = None
+
+    @asyncio.coroutine
+    def primary(self):
+        """Returns the connection to the primary, getting one if needed"""
+        if self._primary_cnx is None:
+            self._primary_cnx = yield from self._router.get_connection(
+                timeout=self._timeout)
+        return self._primary_cnx
+
+    @asyncio.coroutine
+    def replica(self):
+        """Returns the connection used for reads, getting one if needed"""
+        if self._replica_cnx is None:
+            self._replica_cnx = yield from self._router.get_connection(
+                readonly=True, timeout=self._timeout)
+        return self._replica_cnx
+
+    @property
+    def in_transaction(self):
+        """Whether the primary connection is in a transaction
+
+        A transaction started with deferred=True counts as well.
+        """
+        cnx = self._primary_cnx
+        # pylint: disable=W0212
+        return cnx is not None \
+            and bool(cnx.in_transaction or cnx._cnx._pending_begin)
+
+    @property
+    def autocommit(self):
+        """Whether statements on the primary are in autocommit mode
+
+        Taken from the last status reported on the primary connection,
+        or from the configuration of the primary pool when no primary
+        connection is held yet.
+        """
+        # pylint: disable=W0212
+        cnx = self._primary_cnx
+        if cnx is None:
+            config = getattr(self._router.primary, '_cnx_config', {})
+            return bool(config.get('autocommit', False))
+        if cnx._cnx._server_status is None:
+            return bool(cnx._cnx._autocommit)
+        return bool(cnx._cnx._server_status & ServerFlag.STATUS_AUTOCOMMIT)
+
+    @asyncio.coroutine
+    def connection_for(self, operation, multi=False):
+        """Returns the connection operation should be executed on"""
+        if self.force_primary or multi or self.in_transaction \
+                or not self.autocommit or not is_read_statement(operation):
+            return (yield from self.primary())
+        return (yield from self.replica())
+
+    @asyncio.coroutine
+    def execute(self, operation, params=None, multi=False):
+        """Execute a statement on the connection it is routed to
+
+        Returns a buffered AioMySQLCursor.
+        """
+        cnx = yield from self.connection_for(operation, multi)
+        cursor = yield from cnx.cursor(buffered=True)
+        yield from cursor.execute(operation, params, multi)
+        return cursor
+
+    @asyncio.coroutine
+    def start_transaction(self, *args, **kwargs):
+        """Start a transaction on the primary
+
+        Until commit() or rollback(), all statements go to the primary.
+        """
+        cnx = yield from self.primary()
+        yield from cnx.start_transaction(*args, **kwargs)
+
+    @asyncio.coroutine
+    def commit(self):
+        """Commit the transaction on the primary"""
+        if self._primary_cnx is not None:
+            yield from self._primary_cnx.commit()
+
+    @asyncio.coroutine
+    def rollback(self):
+        """Roll back the transaction on the primary"""
+        if self._primary_cnx is not None:
+            yield from self._primary_cnx.rollback()
+
+    @asyncio.coroutine
+    def close(self):
+        """Give the connections back to their pools"""
+        for cnx in (self._primary_cnx, self._replica_cnx):
+            if cnx is not None:
+                task = cnx.close()
+                if task is not None:
+                    yield from task
+        self._primary_cnx = self._replica_cnx = None
+
+    @asyncio.coroutine
+    def __aenter__(self):
+        return self
+
+    @asyncio.coroutine
+    def __aexit__(self, exc_type, exc, tb):
+        yield from self.close()
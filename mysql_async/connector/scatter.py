@@ -0,0 +1,303 @@
+# MySQL Connector/Python - MySQL driver written in Python.
+# Copyright (c) 2014, Oracle and/or its affiliates. All rights reserved.
+
+# MySQL Connector/Python is licensed under the terms of the GPLv2
+# <http://www.gnu.org/licenses/old-licenses/gpl-2.0.html>, like most
+# MySQL Connectors. There are special exceptions to the terms and
+# conditions of the GPLv2 as it is applied to this software, see the
+# FOSS License Exception
+# <http://www.mysql.com/about/legal/licensing/foss-exception.html>.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Running a statement on several shards and merging the rows
+"""
+
+import heapq
+
+from mysql.connector import errors
+import asyncio
+
+# Marks the end of the rows of one target
+_DONE = object()
+
+
+class ScatterGather(object):
+    """Rows of one statement executed concurrently on several targets
+
+    Targets are pools, anything with a get_connection() coroutine, or
+    connections. All targets execute the statement at the same time and
+    each reads its rows in batches of batch_size, keeping at most one
+    batch ahead of the consumer.
+
+    Without order_by, rows are returned in the order batches arrive. With
+    order_by, a sequence of column names or indexes, every target must
+    return its rows sorted on these columns and the rows are merged into
+    one sorted stream; reverse=True for descending order. After limit
+    rows, the remaining targets are stopped.
+
+    Rows are merged comparing Python values, while MySQL sorts strings
+    using the collation of the column, by default ignoring case and
+    accents. String columns in order_by must therefore use a binary
+    collation, or key must be given: a function returning the sort key
+    of a row matching the order of the MySQL server, used instead of
+    order_by, for example lambda row: row[0].casefold().
+
+    Rows are returned using 'async for':
+        async for row in ScatterGather(pools, "SELECT ...", order_by=[0]):
+            ...
+
+    Connections taken from pools are given back when done. A target
+    stopped early has its connection disconnected when it came from a
+    pool; connections given as target are read to the end instead, since
+    they stay in use by the caller.
+    """
+
+    def __init__(self, targets, operation, params=None, order_by=None,
+                 reverse=False, limit=None, batch_size=100, key=None,
+                 loop=None):
+        self._loop = loop or asyncio.get_event_loop()
+        self._targets = list(targets)
+        self._operation = operation
+        self._params = params
+        self._order_by = order_by
+        self._reverse = reverse
+        self._key = key
+        self._merge = order_by is not None or key is not None
+        self._limit = limit
+        self._batch_size = batch_size
+        self._tasks = []
+        self._queues = []
+        self._stopped = False
+        self._returned = 0
+        self._pending = 0
+        self._heap = None
+        self._batch = []
+        self._batch_pos = 0
+
+    def start(self):
+        """Execute the statement on all targets"""
+        if self._tasks:
+            return
+        if not self._merge:
+            # Batches of all targets go through one queue
+            queue = asyncio.Queue(maxsize=len(self._targets), loop=self._loop)
+            self._queues = [queue] * len(self._targets)
+        else:
+            self._queues = [asyncio.Queue(maxsize=1, loop=self._loop)
+                            for _ in self._targets]
+        self._pending = len(self._targets)
+        self._tasks = [self._loop.create_task(self._run(idx, target))
+                       for idx, target in enumerate(self._targets)]
+
+    def _key_function(self, description):
+        """Returns a function getting the sort key of a row
+
+        NULL sorts before any value, and after any value with reverse,
+        like in MySQL.
+        """
+        if self._key is not None:
+            if self._reverse:
+                return lambda row: _Reversed(self._key(row))
+            return self._key
+        names = [column[0] for column in description]
+        indexes = []
+        for column in self._order_by:
+            if isinstance(column, int):
+                indexes.append(column)
+            else:
+                try:
+                    indexes.append(names.index(column))
+                except ValueError:
+                    raise errors.ProgrammingError(
+                        "Unknown column {0} in order_by".format(column))
+        if self._reverse:
+            return lambda row: _Reversed(tuple(
+                (row[i] is not None, row[i]) for i in indexes))
+        return lambda row: tuple((row[i] is not None, row[i])
+                                 for i in indexes)
+
+    @asyncio.coroutine
+    def _run(self, idx, target):
+        """Execute the statement on one target and queue its batches"""
+        queue = self._queues[idx]
+        pooled = hasattr(target, 'get_connection')
+        cnx = None
+        try:
+            if pooled:
+                cnx = yield from target.get_connection()
+            else:
+                cnx = target
+            cursor = yield from cnx.cursor()
+            yield from cursor.execute(self._operation, self._params)
+            key = None
+            if self._merge:
+                key = self._key_function(cursor.description)
+            while not self._stopped:
+                rows = yield from cursor.fetchmany(self._batch_size)
+                if not rows:
+                    break
+                yield from queue.put((idx, rows, key))
+            if not pooled and cnx.unread_result:
+                yield from cnx.discard_result()
+        except asyncio.CancelledError:
+            if pooled and cnx is not None:
+                # Stopped in the middle of a result
+                cnx.disconnect()
+            raise
+        except Exception as err:  # pylint: disable=W0703
+            if not self._stopped:
+                yield from queue.put((idx, err, None))
+            return
+        finally:
+            if pooled and cnx is not None:
+                cnx.close()
+        if not self._stopped:
+            yield from queue.put((idx, _DONE, None))
+
+    @asyncio.coroutine
+    def _next_batch(self, queue):
+        """Get the next batch of a queue, raising errors of targets
+
+        Returns a tuple (index, rows, key), rows being None when the
+        target has no more rows.
+        """
+        (idx, rows, key) = yield from queue.get()
+        if rows is _DONE:
+            self._pending -= 1
+            return (idx, None, None)
+        if isinstance(rows, Exception):
+            yield from self.close()
+            raise rows
+        return (idx, rows, key)
+
+    @asyncio.coroutine
+    def _next_concat(self):
+        """Returns the next row in arrival order, or None at the end"""
+        while self._batch_pos >= len(self._batch):
+            if not self._pending:
+                return None
+            (_, rows, _) = yield from self._next_batch(self._queues[0])
+            if rows:
+                self._batch = rows
+                self._batch_pos = 0
+        row = self._batch[self._batch_pos]
+        self._batch_pos += 1
+        return row
+
+    @asyncio.coroutine
+    def _refill(self, idx):
+        """Push the next batch of target idx on the heap"""
+        (_, rows, key) = yield from self._next_batch(self._queues[idx])
+        if rows:
+            heapq.heappush(self._heap, (key(rows[0]), idx, 0, rows, key))
+
+    @asyncio.coroutine
+    def _next_merged(self):
+        """Returns the next row in sort order, or None at the end"""
+        if self._heap is None:
+            self._heap = []
+            for idx in range(len(self._targets)):
+                yield from self._refill(idx)
+        if not self._heap:
+            return None
+        (_, idx, pos, rows, key) = self._heap[0]
+        row = rows[pos]
+        pos += 1
+        if pos < len(rows):
+            heapq.heapreplace(self._heap, (key(rows[pos]), idx, pos,
+                                           rows, key))
+        else:
+            heapq.heappop(self._heap)
+            yield from self._refill(idx)
+        return row
+
+    @asyncio.coroutine
+    def fetchone(self):
+        """Returns the next row, or None when all rows were returned"""
+        self.start()
+        if self._stopped or (self._limit is not None
+                             and self._returned >= self._limit):
+            yield from self.close()
+            return None
+        if not self._merge:
+            row = yield from self._next_concat()
+        else:
+            row = yield from self._next_merged()
+        if row is None:
+            yield from self.close()
+            return None
+        self._returned += 1
+        return row
+
+    @asyncio.coroutine
+    def fetchall(self):
+        """Returns all remaining rows as a list"""
+        rows = []
+        while True:
+            row = yield from self.fetchone()
+            if row is None:
+                return rows
+            rows.append(row)
+
+    @asyncio.coroutine
+    def close(self):
+        """Stop all targets and give their connections back"""
+        if self._stopped:
+            return
+        self._stopped = True
+        for queue in set(self._queues):
+            while not queue.empty():
+                queue.get_nowait()
+        tasks = []
+        for task, target in zip(self._tasks, self._targets):
+            if hasattr(target, 'get_connection'):
+                task.cancel()
+            tasks.append(task)
+        if tasks:
+            yield from asyncio.wait(tasks, loop=self._loop)
+
+    def __aiter__(self):
+        return self
+
+    @asyncio.coroutine
+    def __anext__(self):
+        row = yield from self.fetchone()
+        if row is None:
+            raise StopAsyncIteration
+        return row
+
+
+class _Reversed(object):
+    """Sort key comparing in descending order"""
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+
+def scatter_gather(targets, operation, params=None, **kwargs):
+    """Execute operation on all targets concurrently
+
+    See ScatterGather for the arguments.
+
+    Returns a ScatterGather instance to iterate with 'async for'.
+    """
+    return ScatterGather(targets, operation, params, **kwargs)
@@ -0,0 +1,246 @@
+# MySQL Connector/Python - MySQL driver written in Python.
+# Copyright (c) 2014, Oracle and/or its affiliates. All rights reserved.
+
+# MySQL Connector/Python is licensed under the terms of the GPLv2
+# <http://www.gnu.org/licenses/old-licenses/gpl-2.0.html>, like most
+# MySQL Connectors. There are special exceptions to the terms and
+# conditions of the GPLv2 as it is applied to this software, see the
+# FOSS License Exception
+# <http://www.mysql.com/about/legal/licensing/foss-exception.html>.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301 USA
+
+"""Routing connections to shards by shard key
+"""
+
+import hashlib
+from bisect import bisect_left, bisect_right
+
+from mysql.connector import errors
+from . import _CONNECTION_POOLS
+from .pooling import MySQLConPool, generate_pool_name, CONNECTION_POOL_LOCK
+import asyncio
+
+
+def _hash(value):
+    """Hash a shard key or ring point to a 64-bit integer"""
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    elif not isinstance(value, (bytes, bytearray)):
+        value = str(value).encode('utf-8')
+    return int.from_bytes(hashlib.md5(value).digest()[:8], 'big')
+
+
+class HashRing(object):
+    """Consistent hash ring with virtual nodes
+
+    Every shard is placed vnodes times its weight on the ring. Adding or
+    removing a shard only moves the keys between its points and their
+    neighbours, about 1/N of all keys.
+    """
+
+    def __init__(self, vnodes=160):
+        self._vnodes = vnodes
+        self._points = []
+        self._shards = []
+        self._weights = {}
+
+    def add(self, shard, weight=1):
+        """Place shard on the ring"""
+        if shard in self._weights:
+            raise ValueError("Shard {0} already on the ring".format(shard))
+        self._weights[shard] = weight
+        for i in range(int(self._vnodes * weight)):
+            point = _hash("{0}#{1}".format(shard, i))
+            idx = bisect_left(self._points, point)
+            self._points.insert(idx, point)
+            self._shards.insert(idx, shard)
+
+    def remove(self, shard):
+        """Take shard off the ring"""
+        del self._weights[shard]
+        keep = [(point, name) for point, name in
+                zip(self._points, self._shards) if name != shard]
+        self._points = [point for point, _ in keep]
+        self._shards = [name for _, name in keep]
+
+    @property
+    def shards(self):
+        """List of the shards on the ring"""
+        return list(self._weights)
+
+    def lookup(self, key):
+        """Returns the shard owning key"""
+        if not self._points:
+            raise errors.InterfaceError("No shards available")
+        idx = bisect_right(self._points, _hash(key))
+        if idx == len(self._points):
+            idx = 0
+        return self._shards[idx]
+
+
+class RangeMap(object):
+    """Shard keys mapped to shards by ranges
+
+    ranges is a sequence of (lower_bound, shard) tuples; a key belongs to
+    the shard with the highest lower bound not above the key.
+    """
+
+    def __init__(self, ranges):
+        ranges = sorted(ranges, key=lambda item: item[0])
+        self._bounds = [bound for bound, _ in ranges]
+        self._range_shards = [shard for _, shard in ranges]
+
+    @property
+    def shards(self):
+        """List of the shards in the map"""
+        return list(dict.fromkeys(self._range_shards))
+
+    def lookup(self, key):
+        """Returns the shard owning key"""
+        idx = bisect_right(self._bounds, key) - 1
+        if idx < 0:
+            raise errors.InterfaceError(
+                "No shard for key {0!r}".format(key))
+        return self._range_shards[idx]
+
+
+class ShardManager(object):
+    """One pool per shard, routing by shard key
+
+    shards maps shard names to connection arguments. Keys are routed using
+    a consistent hash ring, or using a RangeMap when ranges is given. Pool
+    arguments common to all shards are given as keyword arguments.
+
+    Pools are created on first use and registered like the pools of
+    connect(), so shards on the same server and database share one pool,
+    and shards which are never used do not hold connections. close() only
+    closes the pools this manager created.
+    """
+
+    def __init__(self, shards, ranges=None, vnodes=160, **kwargs):
+        self._loop = kwargs.pop('loop', None) or asyncio.get_event_loop()
+        self._pool_config = kwargs
+        self._configs = {}
+        self._pools = {}
+        self._created = set()
+        self._routed = {}
+        if ranges is not None:
+            self._map = RangeMap(ranges)
+        else:
+            self._map = HashRing(vnodes)
+        for name, config in shards.items():
+            self.add_shard(name, config)
+        unknown = set(self._map.shards) - set(self._configs)
+        if unknown:
+            raise ValueError("Unknown shard{0} in ranges: {1}".format(
+                's' if len(unknown) > 1 else '', ', '.join(map(str, unknown))))
+
+    def add_shard(self, name, config, weight=1):
+        """Add a shard; with a hash ring, some keys move to it"""
+        if isinstance(self._map, HashRing):
+            self._map.add(name, weight)
+        self._configs[name] = config
+        self._routed[name] = 0
+
+    def remove_shard(self, name):
+        """Remove a shard from the hash ring
+
+        Its pool stays in the registry, it could be shared.
+        """
+        if not isinstance(self._map, HashRing):
+            raise errors.NotSupportedError(
+                "Shards can only be removed from a hash ring")
+        self._map.remove(name)
+        del self._configs[name]
+        del self._routed[name]
+        self._pools.pop(name, None)
+
+    def shard_for(self, key):
+        """Returns the name of the shard owning key"""
+        return self._map.lookup(key)
+
+    def get_pool(self, shard):
+        """Returns the pool of shard, creating it when needed"""
+        try:
+            return self._pools[shard]
+        except KeyError:
+            pass
+        try:
+            config = dict(self._pool_config, **self._configs[shard])
+        except KeyError:
+            raise errors.InterfaceError("Unknown shard {0}".format(shard))
+        pool_name = config.get('pool_name') or generate_pool_name(**config)
+        config['pool_name'] = pool_name
+        with CONNECTION_POOL_LOCK:
+            pool = _CONNECTION_POOLS.get(pool_name)
+            if pool is None:
+                pool = MySQLConPool(loop=self._loop, **config)
+                _CONNECTION_POOLS[pool_name] = pool
+                self._created.add(pool)
+        self._pools[shard] = pool
+        return pool
+
+    @asyncio.coroutine
+    def get_connection(self, key, timeout=None, priority=0):
+        """Get a connection to the shard owning key
+
+        Returns a PooledMySQLConnection instance.
+        """
+        shard = self.shard_for(key)
+        pool = self.get_pool(shard)
+        self._routed[shard] += 1
+        return (yield from pool.get_connection(timeout=timeout,
+                                               priority=priority))
+
+    def acquire(self, key, timeout=None, priority=0):
+        """Get a connection to the shard owning key for 'async with'
+
+        Returns an asynchronous context manager.
+        """
+        shard = self.shard_for(key)
+        pool = self.get_pool(shard)
+        self._routed[shard] += 1
+        return pool.acquire(timeout=timeout, priority=priority)
+
+    def stats(self):
+        """Returns the metrics of every shard, by shard name
+
+        Shards whose pool was not created yet only report how often they
+        were routed to.
+        """
+        result = {}
+        for shard, routed in self._routed.items():
+            pool = self._pools.get(shard)
+            stats = pool.metrics.snapshot() if pool is not None else {}
+            stats['routed'] = routed
+            stats['pool_name'] = pool.pool_name if pool is not None else None
+            result[shard] = stats
+        return result
+
+    @asyncio.coroutine
+    def close(self):
+        """Close the pools this manager created
+
+        They are removed from the registry. Pools which already existed
+        when a shard was first used are left open, since others use them.
+        """
+        pools = self._created
+        self._pools = {}
+        self._created = set()
+        for pool in pools:
+            with CONNECTION_POOL_LOCK:
+                if _CONNECTION_POOLS.get(pool.pool_name) is pool:
+                    del _CONNECTION_POOLS[pool.pool_name]
+            yield from pool.close()